@@ -13,19 +13,52 @@
 """
 
 from __future__ import annotations
-from collections import defaultdict
-from functools import partial
+import time
+
+# момент запуска для --startup-time, до импорта остальных модулей
+STARTED = time.perf_counter()
+
+import argparse
+from array import array
+import asyncio
+from collections import defaultdict, deque
+import csv
+from functools import lru_cache, partial
+import io
+import json
 import math
-from typing import Any, List, Optional, Tuple
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+import os
+from typing import Any, BinaryIO, Callable, List, Optional, Tuple
 from operator import itemgetter
 import pygame
+import queue
 import random
+import struct
+import sys
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 SCREEN_DIM = (800, 600)
+BASIS_CACHE_SIZE = 64
+SPRITE_CACHE_SIZE = 16
+POINT_SPEED = 120
 
 
 class Vec2d:
+    """
+    Двумерный вектор
+
+    Операторы +, - и * возвращают новый вектор, а +=, -= и *= меняют
+    вектор на месте, не создавая объектов
+    """
+    __slots__ = ("x", "y")
     x: float
     y: float
 
@@ -33,6 +66,11 @@ class Vec2d:
         self.y = y
         self.x = x
 
+    @staticmethod
+    def zero() -> Vec2d:
+        "возвращает новый нулевой вектор"
+        return Vec2d(0.0, 0.0)
+
     def __add__(self, vec: Vec2d) -> Vec2d:
         "возвращает сумму двух векторов"
         return Vec2d(self.x + vec.x, self.y + vec.y)
@@ -48,6 +86,24 @@ class Vec2d:
     def __rmul__(self, num: float) -> Vec2d:
         return self.__mul__(num)
 
+    def __iadd__(self, vec: Vec2d) -> Vec2d:
+        "прибавляет вектор на месте"
+        self.x += vec.x
+        self.y += vec.y
+        return self
+
+    def __isub__(self, vec: Vec2d) -> Vec2d:
+        "вычитает вектор на месте"
+        self.x -= vec.x
+        self.y -= vec.y
+        return self
+
+    def __imul__(self, num: float) -> Vec2d:
+        "умножает вектор на число на месте"
+        self.x *= num
+        self.y *= num
+        return self
+
     def __len__(self) -> int:
         "возвращает длину вектора"
         return round(math.sqrt(self.x ** 2 + self.y ** 2))
@@ -70,12 +126,55 @@ class Display:
     с дополнительными аттрибутами высоты и ширины экрана, 
     
     а также заданием подписи при инициализации
+
+    В режиме dirty_rects очищаются и выводятся на экран только области,
+    нарисованные в прошлом и текущем кадрах
+
+    В режиме trail кривые рисуются в накопительный слой, который
+    вместо очистки гаснет: каждый кадр он умножается на trail одним
+    смешивающим blit готовой серой поверхности, а второй blit вычитает 1,
+    чтобы округление умножения не оставляло тусклого следа. compose
+    выводит слой на экран, и все нарисованное после него поверх кривых
+    в след не попадает. След меняет весь экран, поэтому dirty_rects
+    в этом режиме не действует
     """
-    def __init__(self, screen_size: Tuple[int,int], caption: str) -> None:
+    def __init__(self, screen_size: Tuple[int,int], caption: str,
+                 dirty_rects: bool = False,
+                 trail: Optional[float] = None) -> None:
+        if trail is not None and not 0 <= trail < 1:
+            raise ValueError(f"trail decay {trail} is not in [0, 1)")
         self.width = screen_size[0] 
         self.height = screen_size[1] 
+        self.dirty_rects = dirty_rects and trail is None
+        self.trail = trail
+        self.__drawn = []
+        self.__prev_drawn = []
         self.__surface = pygame.display.set_mode(screen_size)
+        self.__target = self.__surface
         pygame.display.set_caption(caption)
+        if trail is not None:
+            level = int(trail * 256)
+            self.__canvas = self.__layer((0, 0, 0))
+            self.__fade = self.__layer((level, level, level))
+            self.__drain = self.__layer((1, 1, 1))
+
+    @staticmethod
+    def trail_decay(value: str) -> float:
+        """разбирает затухание следа для argparse: число в [0, 1)"""
+        try:
+            decay = float(value)
+        except ValueError:
+            decay = None
+        if decay is None or not 0 <= decay < 1:
+            raise argparse.ArgumentTypeError(
+                f"trail decay must be a number in [0, 1), got {value!r}")
+        return decay
+
+    def __layer(self, color: Tuple[int, int, int]) -> pygame.Surface:
+        """поверхность размером с экран в его формате, залитая color"""
+        layer = pygame.Surface((self.width, self.height)).convert()
+        layer.fill(color)
+        return layer
 
     def __getattr__(self, name: str) -> Any:
         return self.__surface.__getattribute__(name)
@@ -89,8 +188,51 @@ class Display:
         pygame.display.quit(*args, **kwargs)
 
     def get_surface(self):
-        """возвращает сущность Surface, для разрешения несоответствия типов"""
-        return self.__surface
+        """
+        возвращает сущность Surface, для разрешения несоответствия типов;
+        в режиме trail до compose это накопительный слой
+        """
+        return self.__target
+
+    def mark_dirty(self, rect: Any) -> None:
+        """запоминает область, нарисованную в текущем кадре"""
+        if self.dirty_rects:
+            self.__drawn.append(pygame.Rect(rect))
+
+    def clear(self, color: Any) -> None:
+        """
+        очищает экран, а в режиме dirty_rects - 
+        только области, нарисованные в прошлом кадре;
+        в режиме trail гасит накопительный слой к черному
+        """
+        if self.trail is not None:
+            self.__canvas.blit(self.__fade, (0, 0),
+                               special_flags=pygame.BLEND_RGB_MULT)
+            self.__canvas.blit(self.__drain, (0, 0),
+                               special_flags=pygame.BLEND_RGB_SUB)
+            self.__target = self.__canvas
+            return
+        if not self.dirty_rects:
+            self.__surface.fill(color)
+            return
+        for rect in self.__prev_drawn:
+            self.__surface.fill(color, rect)
+
+    def compose(self) -> None:
+        """в режиме trail выводит накопительный слой на экран"""
+        if self.trail is None:
+            return
+        self.__surface.blit(self.__canvas, (0, 0))
+        self.__target = self.__surface
+
+    def present(self) -> None:
+        """выводит кадр на экран"""
+        if not self.dirty_rects:
+            pygame.display.flip()
+            return
+        pygame.display.update(self.__prev_drawn + self.__drawn)
+        self.__prev_drawn = self.__drawn
+        self.__drawn = []
 
 
 class Polyline:
@@ -98,76 +240,493 @@ class Polyline:
     Описывает ломаную, состоящую из набора точек со скоростями
 
     Набор точек на экране
+
+    В режиме use_numpy координаты и скорости хранятся в непрерывных
+    массивах (N, 2), а движение и отражение от стен считаются сразу
+    для всего массива
+
+    Положения до последнего шага хранятся в prev_points, 
+    чтобы отрисовка могла интерполировать между шагами симуляции
+
+    В режиме use_numpy points и speeds - срезы буферов с запасом:
+    добавление точки пишет в свободную строку, а очищенная ломаная
+    сохраняет буферы и заполняется заново без выделения памяти
+
+    on_resize вызывается после каждого изменения числа точек
+
+    В установившемся режиме кадр не создает объектов: точки Vec2d
+    двигаются на месте, prev_points переписывается в прежний буфер,
+    а промежуточные и экранные координаты для отрисовки пишутся
+    в переиспользуемые списки
     """
     display: Display
-    points: List[Vec2d]
-    speeds: List[Vec2d]
+    points: Any
+    speeds: Any
+    prev_points: Any
+    use_numpy: bool
+    version: int
+    on_resize: Optional[Callable[["Polyline"], None]] = None
 
-    def __init__(self, display: Display) -> None:
-        self.points = []
-        self.speeds = []
+    def __init__(self, display: Display,
+                 use_numpy: Optional[bool] = None) -> None:
+        self.use_numpy = np is not None if use_numpy is None else use_numpy
+        if self.use_numpy and np is None:
+            raise ImportError("numpy is required for use_numpy=True")
         self.display = display
+        self.version = 0
+        self.__point_buffer = self.__speed_buffer = None
+        self.__draw_buffers = {}
+        self.clear()
+
+    def __buffers(self, size: int) -> Tuple[Any, Any]:
+        """
+        возвращает буферы точек и скоростей не меньше size строк;
+        если points заменили снаружи, буферами становятся сами массивы
+        """
+        if (self.points is not self.__points_view
+                or self.speeds is not self.__speeds_view):
+            self.__point_buffer, self.__speed_buffer = self.points, self.speeds
+        capacity = len(self.__point_buffer)
+        if capacity < size:
+            count = len(self.points)
+            capacity = max(size, 2 * capacity, 4)
+            points = np.empty((capacity, 2))
+            speeds = np.empty((capacity, 2))
+            points[:count] = self.points
+            speeds[:count] = self.speeds
+            self.__point_buffer, self.__speed_buffer = points, speeds
+        return self.__point_buffer, self.__speed_buffer
+
+    def __resize(self, count: int) -> None:
+        """делает points и speeds срезами буферов длины count"""
+        self.points = self.__points_view = self.__point_buffer[:count]
+        self.speeds = self.__speeds_view = self.__speed_buffer[:count]
+
+    def _resized(self) -> None:
+        """сообщает владельцу об изменении числа точек"""
+        if self.on_resize is not None:
+            self.on_resize(self)
+
+    def clear(self) -> None:
+        """удаляет все точки ломаной, сохраняя буферы под новые"""
+        self.version += 1
+        self.prev_points = None
+        if self.use_numpy:
+            if self.__point_buffer is None:
+                self.__point_buffer = np.empty((0, 2))
+                self.__speed_buffer = np.empty((0, 2))
+            else:
+                self.__buffers(0)
+            self.__resize(0)
+        else:
+            self.points = []
+            self.speeds = []
+        self._resized()
+
+    def add_point(self, point: Vec2d, speed: Vec2d) -> None:
+        """добавляет в ломаную точку с ее скоростью"""
+        self.version += 1
+        if self.use_numpy:
+            count = len(self.points)
+            points, speeds = self.__buffers(count + 1)
+            points[count] = (point.x, point.y)
+            speeds[count] = (speed.x, speed.y)
+            self.__resize(count + 1)
+        else:
+            self.points.append(point)
+            self.speeds.append(speed)
+        self._resized()
 
-    def recalc_points(self) -> None:
+    def remove_point(self, index: int) -> None:
+        """удаляет точку ломаной вместе с ее скоростью"""
+        self.version += 1
+        if self.use_numpy:
+            count = len(self.points)
+            index %= count
+            points, speeds = self.__buffers(count)
+            points[index:count - 1] = points[index + 1:count]
+            speeds[index:count - 1] = speeds[index + 1:count]
+            self.__resize(count - 1)
+        else:
+            self.points.pop(index)
+            self.speeds.pop(index)
+        self._resized()
+
+    def set_points(self, points: Any, speeds: Any) -> None:
+        """
+        заменяет все точки и скорости: массивами (N, 2) в режиме
+        use_numpy или списками Vec2d; массивы не копируются
+        """
+        self.version += 1
+        self.prev_points = None
+        self.points = points
+        self.speeds = speeds
+        self._resized()
+
+    def assign_points(self, points: Any, speeds: Any) -> None:
+        """
+        заменяет все точки и скорости координатами (N, 2), копируя
+        их в буферы ломаной, которые растут только при нехватке места
+        """
+        self.version += 1
+        self.prev_points = None
+        if self.use_numpy:
+            points = np.asarray(points, dtype=float).reshape(-1, 2)
+            speeds = np.asarray(speeds, dtype=float).reshape(-1, 2)
+            count = len(points)
+            self.__buffers(0)
+            if len(self.__point_buffer) < count:
+                self.__point_buffer = np.empty((count, 2))
+                self.__speed_buffer = np.empty((count, 2))
+            self.__point_buffer[:count] = points
+            self.__speed_buffer[:count] = speeds
+            self.__resize(count)
+        else:
+            self.points = [Vec2d(x, y) for x, y in points]
+            self.speeds = [Vec2d(x, y) for x, y in speeds]
+        self._resized()
+
+    def scale_speeds(self, factor: float) -> None:
+        """умножает скорости всех точек на число"""
+        if self.use_numpy:
+            self.speeds *= factor
+        else:
+            self.speeds = [speed * factor for speed in self.speeds]
+
+    def recalc_points(self, dt: float = 1.0) -> None:
         """
         функция перерасчета координат опорных точек
+
+        сдвигает точки на speed * dt
         """
-        i = 0
+        self.version += 1
+        self.prev_points = self._copy_points(self.points, self.prev_points)
+        if self.use_numpy:
+            self._move_arrays(self.points, self.speeds, dt,
+                              self.display.width, self.display.height)
+            return
+
+        width = self.display.width
+        height = self.display.height
         for point, speed in zip(self.points, self.speeds):
-            newpoint = point + speed
-            self.points[i] = newpoint
-            if newpoint.x > self.display.width or newpoint.x < 0:
-                self.speeds[i] = Vec2d(- self.speeds[i].x, self.speeds[i].y)
-            if newpoint.y > self.display.height or newpoint.y < 0:
-                self.speeds[i] = Vec2d(self.speeds[i].x, -self.speeds[i].y)
-            i += 1
+            point.x += speed.x * dt
+            point.y += speed.y * dt
+            if point.x > width or point.x < 0:
+                speed.x = -speed.x
+            if point.y > height or point.y < 0:
+                speed.y = -speed.y
+
+    @staticmethod
+    def _move_arrays(points: Any, speeds: Any, dt: float,
+                     width: int, height: int) -> None:
+        """сдвигает массивы точек на месте и отражает скорости от стен"""
+        points += speeds * dt
+        for axis, bound in enumerate((width, height)):
+            coords = points[:, axis]
+            speeds[(coords > bound) | (coords < 0), axis] *= -1
+
+    @staticmethod
+    def _copy_points(points: Any, out: Any) -> Any:
+        """
+        копирует точки в буфер out и возвращает его; новый буфер
+        создается, только если out не подходит по типу или размеру
+        """
+        if np is not None and isinstance(points, np.ndarray):
+            if (not isinstance(out, np.ndarray) 
+                    or out.shape != points.shape or out is points):
+                return points.copy()
+            np.copyto(out, points)
+            return out
+        if not isinstance(out, list) or out is points:
+            out = []
+        Polyline._fit(out, len(points), Vec2d.zero)
+        for copy, point in zip(out, points):
+            copy.x = point.x
+            copy.y = point.y
+        return out
+
+    @staticmethod
+    def _fit(buffer: List[Any], count: int,
+             make: Callable[[], Any]) -> List[Any]:
+        """
+        подгоняет длину переиспользуемого списка под count,
+        создавая недостающие элементы вызовом make
+        """
+        if len(buffer) > count:
+            del buffer[count:]
+        while len(buffer) < count:
+            buffer.append(make())
+        return buffer
+
+    @staticmethod
+    def _pixel_pair() -> List[int]:
+        return [0, 0]
+
+    @staticmethod
+    def _blit_pair() -> List[Any]:
+        return [None, None]
+
+    def _draw_buffers(self, name: str) -> Tuple[Any, List[Any], List[Any]]:
+        """
+        возвращает буферы отрисовки name: промежуточные положения,
+        экранные координаты и пары для Surface.blits
+        """
+        buffers = self.__draw_buffers.get(name)
+        if buffers is None:
+            buffers = self.__draw_buffers[name] = [None, [], []]
+        return buffers
 
     def _draw_points(self, 
                     points: list,
                     style: str = "points", 
                     width: int = 3, 
-                    color: Tuple[int, int, int] = (255, 255, 255) ) -> None:
+                    color: Tuple[int, int, int] = (255, 255, 255),
+                    buffer: str = "points") -> None:
         """
         функция отрисовки точек на экране
+
+        ломаная рисуется одним вызовом pygame.draw.lines (aalines для
+        стиля "aaline"), точки - одним Surface.blits готового спрайта;
+        экранные координаты пишутся в буферы с именем buffer
         """
-        if style == "line":
-            for p_n in range(-1, len(points) - 1):
-                pygame.draw.line(self.display.get_surface(), color,
-                             points[p_n].int_pair(),
-                             points[p_n + 1].int_pair(), 
-                             width)
+        if len(points) == 0:
+            return
+        surface = self.display.get_surface()
+        buffers = self._draw_buffers(buffer)
+        blits = buffers[2]
+        if style == "line" or style == "aaline":
+            coords = buffers[1] = self._int_pairs(points, out=buffers[1])
+            if len(coords) < 2:
+                return
+            if style == "line":
+                rect = pygame.draw.lines(surface, color, True, coords, width)
+            else:
+                rect = pygame.draw.aalines(surface, color, True, coords)
+            self.display.mark_dirty(rect)
 
         elif style == "points":
-            for point in points:
-                pygame.draw.circle(self.display.get_surface(), color,
-                                   point.int_pair(), width)
+            sprite = self._point_sprite(width, tuple(color))
+            coords = buffers[1] = self._int_pairs(points, offset=width,
+                                                  out=buffers[1])
+            self._fit(blits, len(coords), self._blit_pair)
+            for blit, coord in zip(blits, coords):
+                blit[0] = sprite
+                blit[1] = coord
+            surface.blits(blits, False)
+            if self.display.dirty_rects:
+                left = min(x for x, _ in coords)
+                top = min(y for _, y in coords)
+                self.display.mark_dirty((
+                    left, top,
+                    max(x for x, _ in coords) - left + 2 * width,
+                    max(y for _, y in coords) - top + 2 * width))
+
+    @staticmethod
+    @lru_cache(maxsize=SPRITE_CACHE_SIZE)
+    def _point_sprite(radius: int, color: Tuple[int, ...]) -> pygame.Surface:
+        """возвращает закэшированный спрайт точки заданного радиуса и цвета"""
+        sprite = pygame.Surface((2 * radius, 2 * radius), pygame.SRCALPHA)
+        pygame.draw.circle(sprite, color, (radius, radius), radius)
+        return sprite
 
-    def draw_points(self, *args, **kwargs) -> None:
-        self._draw_points(self.points, *args, **kwargs)
+    @staticmethod
+    def _int_pairs(points, offset: int = 0, out: Any = None) -> Any:
+        """
+        переводит список Vec2d или массив (N, 2) в плоский буфер 
+        целочисленных координат, сдвинутых на offset
+
+        Для массива результат - целочисленный массив (N, 2): pygame
+        принимает его без промежуточных списков. Если задан буфер out
+        подходящего вида, координаты пишутся в него: в массив той же
+        формы или в пары [x, y] списка для Vec2d
+        """
+        if np is not None and isinstance(points, np.ndarray):
+            if (not isinstance(out, np.ndarray) 
+                    or out.shape != points.shape):
+                return np.rint(points).astype(int) - offset
+            np.rint(points, out=out, casting="unsafe")
+            out -= offset
+            return out
+        if np is not None and isinstance(out, np.ndarray):
+            out = []
+        if out is not None:
+            Polyline._fit(out, len(points), Polyline._pixel_pair)
+            for pair, point in zip(out, points):
+                pair[0] = round(point.x) - offset
+                pair[1] = round(point.y) - offset
+            return out
+        if offset:
+            return [(x - offset, y - offset)
+                    for x, y in (point.int_pair() for point in points)]
+        return [point.int_pair() for point in points]
+
+    @staticmethod
+    def _interpolate(prev: Any, curr: Any, alpha: float,
+                     out: Any = None) -> Any:
+        """
+        возвращает положения между прошлым и текущим шагом симуляции,
+        если набор точек с тех пор не менялся; результат пишется
+        в буфер out, если он подходит (см. _copy_points)
+        """
+        if alpha >= 1 or prev is None or len(prev) != len(curr):
+            return curr
+        if np is not None and isinstance(curr, np.ndarray):
+            if not isinstance(out, np.ndarray) or out.shape != curr.shape:
+                return prev + (curr - prev) * alpha
+            np.subtract(curr, prev, out=out)
+            out *= alpha
+            out += prev
+            return out
+        if out is None:
+            return [p + (c - p) * alpha for p, c in zip(prev, curr)]
+        Polyline._fit(out, len(curr), Vec2d.zero)
+        for point, p, c in zip(out, prev, curr):
+            point.x = p.x + (c.x - p.x) * alpha
+            point.y = p.y + (c.y - p.y) * alpha
+        return out
+
+    def _interpolate_into(self, prev: Any, curr: Any, alpha: float,
+                          buffer: str) -> Any:
+        """_interpolate в буфер промежуточных положений buffer"""
+        buffers = self._draw_buffers(buffer)
+        if alpha >= 1 or prev is None or len(prev) != len(curr):
+            return curr
+        if np is not None and isinstance(curr, np.ndarray):
+            if (not isinstance(buffers[0], np.ndarray)
+                    or buffers[0].shape != curr.shape):
+                buffers[0] = np.empty_like(curr)
+        elif not isinstance(buffers[0], list):
+            buffers[0] = []
+        return self._interpolate(prev, curr, alpha, buffers[0])
+
+    def draw_points(self, *args, alpha: float = 1.0, **kwargs) -> None:
+        self._draw_points(
+            self._interpolate_into(self.prev_points, self.points, alpha,
+                                   "points"),
+            *args, **kwargs)
         
 
 class Knot(Polyline):
     """
     Описывает замкнутую кривую, которая строится по точкам
+
+    В режиме use_numpy все сегменты кривой считаются одним
+    матричным умножением и knot_points хранится как массив (N, 2),
+    иначе используется поточечный расчет на Vec2d
+
+    Точки кривой хранятся по сегментам: сегмент s строится по опорным
+    точкам s-2, s-1, s, поэтому при правке одной опорной точки
+    пересчитываются только соседние с ней сегменты
+
+    Если задан tolerance, число точек каждого сегмента подбирается
+    по его кривизне и длине на экране так, чтобы ломаная отклонялась
+    от кривой не больше чем на tolerance пикселей; оно лежит в пределах
+    от min_samples до knot_points_count
+
+    lod - уровень упрощения кривой: с первого уровня она рисуется
+    тонкой линией, а каждый следующий вдвое сокращает число точек
+
+    Без numpy сегменты - списки Vec2d, которые пересчитываются на месте;
+    knot_points собирается заново, только когда меняется их состав
     """
+    MIN_EDGE = 2
+    MAX_KNOT_POINTS = 1000
     knot_points_count: int
-    knot_points: List[Vec2d]
+    knot_points: Any
+    tolerance: Optional[float]
+    min_samples: int
+    lod: int
+    __segment_buffer: Any = None
+    __relayout: bool = True
+    # номер раскладки точек кривой по сегментам: текущей и той,
+    # что была у prev_knot_points
+    __layout: int = 0
+    __prev_layout: int = 0
 
-    def __init__(self, display: Display, knot_points_count=35) -> None:
-        super().__init__(display)
+    def __init__(self, display: Display, knot_points_count=35,
+                 use_numpy: Optional[bool] = None,
+                 tolerance: Optional[float] = None,
+                 min_samples: int = 2) -> None:
+        if tolerance is not None and not 0 < tolerance < math.inf:
+            raise ValueError(f"tolerance {tolerance} is not a positive "
+                             f"number of pixels")
+        super().__init__(display, use_numpy)
         self.knot_points_count = knot_points_count
+        self.tolerance = tolerance
+        self.min_samples = min_samples
+        self.lod = 0
+
+    @staticmethod
+    def pixel_tolerance(value: str) -> float:
+        """разбирает tolerance для argparse: конечное число больше 0"""
+        try:
+            tolerance = float(value)
+        except ValueError:
+            tolerance = None
+        if tolerance is None or not 0 < tolerance < math.inf:
+            raise argparse.ArgumentTypeError(
+                f"tolerance must be a positive number of pixels, "
+                f"got {value!r}")
+        return tolerance
+
+    @property
+    def samples(self) -> int:
+        """число точек сегмента с учетом уровня упрощения"""
+        if self.lod <= 1:
+            return self.knot_points_count
+        return max(1, self.knot_points_count >> (self.lod - 1))
+
+    def clear(self) -> None:
+        """Удаляет все опорные точки и саму кривую"""
+        super().clear()
         self.knot_points = []
-        self.points = []
-        self.speeds = []
+        self.prev_knot_points = None
+        self._segments = None
+        self._segments_count = 0
+        self._dirty = set()
+        self.__relayout = True
 
     def add_base_point(self, point: Vec2d, speed: Vec2d) -> None:
         """Добавляет опорную точку и перерасчитывает кривую"""
-        self.points.append(point)
-        self.speeds.append(speed)
+        self.add_point(point, speed)
+        self.__mark_inserted(len(self.points) - 1)
+        self.recalc_knot()
+
+    def set_points(self, points: Any, speeds: Any) -> None:
+        """Заменяет все опорные точки и перестраивает кривую целиком"""
+        super().set_points(points, speeds)
+        self.prev_knot_points = None
+        self._segments = None
+        self.recalc_knot()
+
+    def assign_points(self, points: Any, speeds: Any) -> None:
+        """
+        Копирует координаты опорных точек в буферы кривой
+        и перестраивает ее целиком
+        """
+        super().assign_points(points, speeds)
+        self.prev_knot_points = None
+        self._segments = None
+        self.recalc_knot()
+
+    def set_base_point(self, index: int, point: Vec2d) -> None:
+        """Перемещает опорную точку и перерасчитывает соседние сегменты"""
+        self.version += 1
+        if self.use_numpy:
+            self.points[index] = (point.x, point.y)
+        else:
+            self.points[index] = point
+        self.__mark_changed(index)
         self.recalc_knot()
 
     def delete_base_point(self, point: Vec2d) -> None:
         """Удаляет ближайшую к месту нажатия опорную точку текущей кривой"""
+        if self.use_numpy:
+            dists = np.abs(self.points - (point.x, point.y)).sum(axis=1)
+            if len(dists) and dists.min() <= 5:
+                self.delete_base_point_at(int(dists.argmin()))
+            return
+
         del_candidates = sorted(
             [(i,dist) for i in range(len(self.points)) 
                 if (dist := self.points[i].calc_distance_to(point)) <= 5],
@@ -176,78 +735,638 @@ class Knot(Polyline):
 
         if del_candidates:
             v, _ = del_candidates[0]
-            self.points.pop(v)
-            self.recalc_knot()
+            self.delete_base_point_at(v)
 
-    def recalc_points(self) -> None:
-        super().recalc_points()
+    def delete_base_point_at(self, index: int) -> None:
+        """Удаляет опорную точку с номером index"""
+        self.remove_point(index)
+        self.__mark_removed(index)
         self.recalc_knot()
 
-    def __get_knot_point(
-            self, smooth_points: List[Vec2d], 
-            alpha: float, deg: Optional[int]=None) -> Vec2d:
+    def recalc_points(self, dt: float = 1.0) -> None:
+        self._keep_prev_knot_points()
+        super().recalc_points(dt)
+        self.invalidate()
+        self.recalc_knot()
+
+    def _keep_prev_knot_points(self) -> None:
+        """запоминает точки кривой перед шагом для интерполяции"""
+        self.prev_knot_points = self._copy_points(self.knot_points,
+                                                  self.prev_knot_points)
+        self.__prev_layout = self.__layout
+
+    def invalidate(self) -> None:
+        """помечает все сегменты кривой для пересчета"""
+        self._dirty.update(range(len(self.points)))
+
+    def __mark_changed(self, index: int) -> None:
+        """помечает сегменты, зависящие от опорной точки index"""
+        count = len(self.points)
+        self._dirty.update((index + shift) % count for shift in range(3))
+
+    def __mark_inserted(self, index: int) -> None:
+        """вставляет пустой сегмент под новую опорную точку index"""
+        if self._segments is None or len(self._segments) != len(self.points) - 1:
+            self._segments = None
+            return
+        if isinstance(self._segments, list):
+            self._segments.insert(index, [])
+            self.__relayout = True
+        else:
+            self._segments = np.insert(self._segments, index, 0, axis=0)
+        self._dirty = {s + (s >= index) for s in self._dirty}
+        self.__mark_changed(index)
+
+    def __mark_removed(self, index: int) -> None:
+        """удаляет сегмент удаленной опорной точки index"""
+        count = len(self.points)
+        if (self._segments is None or len(self._segments) != count + 1
+                or count < 3):
+            self._segments = None
+            return
+        if isinstance(self._segments, list):
+            del self._segments[index]
+            self.__relayout = True
+        else:
+            self._segments = np.delete(self._segments, index, axis=0)
+        self._dirty = {s - (s > index) for s in self._dirty if s != index}
+        self._dirty.update((index + shift) % count for shift in range(2))
+
+    @staticmethod
+    @lru_cache(maxsize=BASIS_CACHE_SIZE)
+    def _knot_weights(deg: int, knot_points_count: int
+                      ) -> Tuple[Tuple[float, ...], ...]:
         """
-        возвращает координаты следующей точки гладкой кривой безье
+        Возвращает таблицу весов контрольных точек для каждого шага
+        кривой степени deg; таблица общая для всех кривых и кадров,
+        при смене knot_points_count старые таблицы вытесняются по LRU
         """
-        if deg is None:
-            deg = len(smooth_points) - 1
-        if deg == 0:
-            return Vec2d(smooth_points[0].x, smooth_points[0].y)
+        weights = []
+        for i in range(knot_points_count):
+            alpha = i / knot_points_count
+            weights.append(
+                ((1 - alpha) ** deg,) +
+                tuple(alpha * (1 - alpha) ** (deg - k)
+                      for k in range(1, deg + 1)))
+        return tuple(weights)
 
-        res = smooth_points[deg] * alpha + self.__get_knot_point(smooth_points, alpha, deg - 1) * (1 - alpha)
-        return Vec2d(res.x, res.y)
-    
-    def __get_knot_points(self, smooth_points: List[Vec2d]) -> List[Vec2d]:
-        """Возвращает все точки"""
-        alpha = 1 / self.knot_points_count
-        return [self.__get_knot_point(smooth_points, i * alpha) 
-                    for i in range(self.knot_points_count)]
+    @staticmethod
+    @lru_cache(maxsize=BASIS_CACHE_SIZE)
+    def _knot_basis(deg: int, knot_points_count: int) -> Any:
+        """
+        Возвращает таблицу весов как неизменяемую матрицу
+        (knot_points_count, deg + 1)
+        """
+        basis = np.array(Knot._knot_weights(deg, knot_points_count))
+        basis.setflags(write=False)
+        return basis
+
+    @staticmethod
+    def _segment_controls(points: Any, index: Any) -> Any:
+        """
+        Возвращает тройки контрольных точек (середина, опорная, середина)
+        сегментов index как массив (len(index), 3, 2)
+        """
+        count = len(points)
+        prev_anchors = points[(index - 2) % count]
+        curr_anchors = points[(index - 1) % count]
+        next_anchors = points[index]
+        return np.stack((
+            0.5 * (prev_anchors + curr_anchors),
+            curr_anchors,
+            0.5 * (curr_anchors + next_anchors)
+            ), axis=1)
+
+    @staticmethod
+    def _segment_points(points: Any, index: Any,
+                        knot_points_count: int) -> Any:
+        """
+        Строит сегменты index разом: контрольные точки 
+        умножаются на матрицу весов
+        """
+        controls = Knot._segment_controls(points, index)
+        return Knot._knot_basis(2, knot_points_count) @ controls
+
+    def __recalc_segments_numpy(self, segments: List[int]) -> None:
+        """Строит перечисленные сегменты разом"""
+        index = np.array(segments)
+        self._segments[index] = self._segment_points(
+            self.points, index, self.samples)
+
+    def __recalc_segments_adaptive_numpy(self, segments: List[int]) -> None:
+        """Строит перечисленные сегменты с подбором числа точек"""
+        controls = self._segment_controls(self.points, np.array(segments))
+        edges = np.hypot(*np.diff(controls, axis=1).transpose(2, 0, 1))
+        for s, control, edge in zip(segments, controls, edges.tolist()):
+            samples = self._adaptive_samples(edge[0], edge[0] + edge[1])
+            if len(self._segments[s]) != samples:
+                self.__layout += 1
+            self._segments[s] = self._knot_basis(2, samples) @ control
+
+    def __recalc_segments(self, segments: List[int]) -> None:
+        """
+        Строит перечисленные сегменты поточечно по закэшированной
+        таблице весов, переписывая точки сегмента на месте
+        """
+        points = self.points
+        samples = self.samples
+        weights = self._knot_weights(2, samples)
+        for s in segments:
+            prev, curr, succ = points[s - 2], points[s - 1], points[s]
+            #точки между опорными
+            x0 = 0.5 * (prev.x + curr.x)
+            y0 = 0.5 * (prev.y + curr.y)
+            x1 = curr.x
+            y1 = curr.y
+            x2 = 0.5 * (curr.x + succ.x)
+            y2 = 0.5 * (curr.y + succ.y)
+            if self.tolerance is not None:
+                flatness = math.hypot(x1 - x0, y1 - y0)
+                samples = self._adaptive_samples(
+                    flatness, flatness + math.hypot(x2 - x1, y2 - y1))
+                weights = self._knot_weights(2, samples)
+            segment = self._segments[s]
+            if len(segment) != samples:
+                segment = self._segments[s] = self._fit([], samples, 
+                                                        Vec2d.zero)
+                self.__relayout = True
+            for point, (w0, w1, w2) in zip(segment, weights):
+                point.x = w0 * x0 + w1 * x1 + w2 * x2
+                point.y = w0 * y0 + w1 * y1 + w2 * y2
+
+    def _adaptive_samples(self, flatness: float, length: float) -> int:
+        """
+        Число точек сегмента: кривая сегмента - квадратичный многочлен
+        со второй производной 2 * (c0 - c1), поэтому при n равных шагах
+        хорда отклоняется от нее на |c0 - c1| / (4 * n^2). Шаги короче
+        MIN_EDGE пикселей не нужны
+        """
+        samples = math.ceil(math.sqrt(flatness / (4 * self.tolerance)))
+        samples = min(samples, math.ceil(length / self.MIN_EDGE))
+        return min(max(samples, self.min_samples), self.samples)
 
     def recalc_knot(self) -> None:
         """
         Добавляет промежуточные точки между опорными и строит точки кривой между ними
+
+        Пересчитываются только помеченные сегменты; вся кривая
+        перестраивается, если изменилось число точек сегмента
         """
-        if len(self.points) < 3:
+        count = len(self.points)
+        if count < 3:
             self.knot_points = []
+            self._segments = None
+            self._dirty.clear()
+            self.__relayout = True
+            self.__layout += 1
+            return
+
+        if (self._segments is None 
+                or len(self._segments) != count
+                or self._segments_count != self.samples):
+            self._segments_count = self.samples
+            self.__layout += 1
+            if self.use_numpy and self.tolerance is None:
+                self._segments = self.__segment_storage(count)
+            else:
+                self._segments = [[] for _ in range(count)]
+                self.__relayout = True
+            self._dirty = set(range(count))
 
+        if self._dirty:
+            segments = sorted(self._dirty)
+            self._dirty.clear()
+            if not self.use_numpy:
+                self.__recalc_segments(segments)
+            elif self.tolerance is None:
+                self.__recalc_segments_numpy(segments)
+            else:
+                self.__recalc_segments_adaptive_numpy(segments)
+
+        if not self.use_numpy:
+            if self.__relayout:
+                self.knot_points = [point for segment in self._segments
+                                    for point in segment]
+                self.__relayout = False
+                self.__layout += 1
+        elif self.tolerance is None:
+            self.knot_points = self._segments.reshape(-1, 2)
         else:
+            self.knot_points = np.concatenate(self._segments)
+
+    def __segment_storage(self, count: int) -> Any:
+        """
+        возвращает массив под count сегментов, переиспользуя буфер
+        прежних сегментов той же длины, в том числе после clear
+        """
+        buffer = self.__segment_buffer
+        if buffer is None or buffer.shape[1] != self.samples:
+            buffer = np.empty((max(count, 4), self.samples, 2))
+            self.__segment_buffer = buffer
+        elif len(buffer) < count:
+            buffer = np.empty((max(count, 2 * len(buffer)), self.samples, 2))
+            self.__segment_buffer = buffer
+        return buffer[:count]
+
+    def _adopt_segments(self, segments: Any) -> None:
+        """принимает полностью пересчитанные извне сегменты кривой"""
+        self._segments = segments
+        self._segments_count = self.samples
+        self._dirty.clear()
+        self.knot_points = segments.reshape(-1, 2)
+
+    def draw_knot(self, style: str = "points", width: int = 3,
+                  color: Tuple[int, int, int] = (255, 255, 255),
+                  alpha: float = 1.0) -> None:
+        if self.lod > 0 and style == "line":
+            width = 1
+        # точки разных раскладок по сегментам не соответствуют друг
+        # другу, даже если их столько же
+        prev = self.prev_knot_points
+        if self.__prev_layout != self.__layout:
+            prev = None
+        super()._draw_points(
+            self._interpolate_into(prev, self.knot_points, alpha, "knot"),
+            style, width, color, "knot")
+
+
+class AnchorGrid:
+    """
+    Равномерная сетка опорных точек всех кривых
+
+    Точки раскладываются по ячейкам размера cell_size, поэтому поиск
+    ближайшей точки в радиусе просматривает лишь соседние ячейки.
+    Сетка помнит ячейку каждой точки, и update переносит только точки,
+    сменившие ячейку с прошлого обновления (для массивов numpy они
+    находятся одним векторным сравнением); координаты при поиске
+    читаются из самих кривых, поэтому сдвиг внутри ячейки сетку
+    не меняет
+    """
+    cell_size: float
+
+    def __init__(self, cell_size: float = 16) -> None:
+        self.cell_size = cell_size
+        # ячейка -> упорядоченное множество пар (кривая, номер точки)
+        self.__cells = {}
+        # для каждой кривой: ячейки ее точек, version на момент
+        # обновления и пары (кривая, номер), создаваемые один раз
+        self.__keys = {}
+        self.__versions = {}
+        self.__entries = {}
+
+    def update(self, knots: List[Knot]) -> None:
+        """переносит в сетку изменения точек кривых с прошлого вызова"""
+        for knot in knots:
+            if self.__versions.get(knot) != knot.version:
+                self.__update_knot(knot)
+                self.__versions[knot] = knot.version
+
+    def __update_knot(self, knot: Knot) -> None:
+        points = knot.points
+        count = len(points)
+        entries = self.__entries.get(knot)
+        if entries is None:
+            entries = self.__entries[knot] = []
+        while len(entries) < count:
+            entries.append((knot, len(entries)))
+        if np is not None and isinstance(points, np.ndarray):
+            self.__update_array(knot, points, entries)
+            return
+
+        keys = self.__keys.get(knot)
+        if not isinstance(keys, list):
+            self.__drop(knot, entries)
+            keys = self.__keys[knot] = [[], []]
+        xs, ys = keys
+        while len(xs) > count:
+            self.__move(entries[len(xs) - 1], (xs.pop(), ys.pop()), None)
+        size = self.cell_size
+        for index, point in enumerate(points):
+            cx = int(point.x // size)
+            cy = int(point.y // size)
+            if index == len(xs):
+                xs.append(cx)
+                ys.append(cy)
+                self.__move(entries[index], None, (cx, cy))
+            elif cx != xs[index] or cy != ys[index]:
+                self.__move(entries[index], (xs[index], ys[index]), (cx, cy))
+                xs[index] = cx
+                ys[index] = cy
+
+    def __update_array(self, knot: Knot, points: Any,
+                       entries: List[Tuple[Knot, int]]) -> None:
+        old = self.__keys.get(knot)
+        if old is not None and not isinstance(old, np.ndarray):
+            self.__drop(knot, entries)
+            old = None
+        cells = np.floor_divide(points, self.cell_size).astype(np.int64)
+        count = len(cells)
+        known = 0 if old is None else min(len(old), count)
+        moved = np.flatnonzero(
+            (cells[:known] != old[:known]).any(axis=1)) if known else ()
+        for index in moved:
+            self.__move(entries[index], 
+                        (int(old[index, 0]), int(old[index, 1])),
+                        (int(cells[index, 0]), int(cells[index, 1])))
+        if old is not None:
+            for index in range(count, len(old)):
+                self.__move(entries[index],
+                            (int(old[index, 0]), int(old[index, 1])), None)
+        for index in range(known, count):
+            self.__move(entries[index], None,
+                        (int(cells[index, 0]), int(cells[index, 1])))
+        self.__keys[knot] = cells
+
+    def __drop(self, knot: Knot, entries: List[Tuple[Knot, int]]) -> None:
+        """убирает из сетки все точки кривой"""
+        keys = self.__keys.pop(knot, None)
+        if isinstance(keys, list):
+            for index, key in enumerate(zip(*keys)):
+                self.__move(entries[index], key, None)
+        elif keys is not None:
+            for index in range(len(keys)):
+                self.__move(entries[index], 
+                            (int(keys[index, 0]), int(keys[index, 1])), None)
+
+    def __move(self, entry: Tuple[Knot, int], old: Optional[Tuple[int, int]],
+               new: Optional[Tuple[int, int]]) -> None:
+        """переносит точку entry из ячейки old в ячейку new"""
+        cells = self.__cells
+        if old is not None:
+            cell = cells[old]
+            del cell[entry]
+            if not cell:
+                del cells[old]
+        if new is not None:
+            cell = cells.get(new)
+            if cell is None:
+                cell = cells[new] = {}
+            cell[entry] = None
+
+    def nearest(self, point: Vec2d, 
+                radius: float) -> Optional[Tuple[Knot, int]]:
+        """
+        возвращает кривую и номер ближайшей (в манхэттенской метрике) 
+        опорной точки не дальше radius или None
+        """
+        size = self.cell_size
+        best = None
+        best_dist = radius
+        for cx in range(int((point.x - radius) // size), 
+                        int((point.x + radius) // size) + 1):
+            for cy in range(int((point.y - radius) // size),
+                            int((point.y + radius) // size) + 1):
+                for entry in self.__cells.get((cx, cy), ()):
+                    knot, index = entry
+                    anchor = knot.points[index]
+                    if isinstance(anchor, Vec2d):
+                        x, y = anchor.x, anchor.y
+                    else:
+                        x, y = float(anchor[0]), float(anchor[1])
+                    dist = abs(x - point.x) + abs(y - point.y)
+                    if dist < best_dist or best is None and dist <= radius:
+                        best = entry
+                        best_dist = dist
+        return best
 
-            res = []
-            for i in range(-2, len(self.points) - 2):
-                #точки между опорными
-                smooth_points = [
-                    0.5 * (self.points[i] + self.points[i + 1]), 
-                    self.points[i + 1],  
-                    0.5 * (self.points[i+1] + self.points[i + 2])
-                    ]
-                res.extend(self.__get_knot_points(smooth_points))
-        
-            self.knot_points = res 
 
-    def draw_knot(self, *args, **kwargs) -> None:
-        super()._draw_points(self.knot_points, *args, **kwargs)
+class AnchorInteraction:
+    """
+    Взаимодействие опорных точек всех кривых между собой
+
+    В режиме "repel" точки ближе radius отталкиваются с ускорением
+    до strength пикс/с^2, линейно спадающим к границе радиуса;
+    в режиме "bounce" сближающиеся точки упруго соударяются,
+    strength - коэффициент восстановления
+
+    Пары ищутся по сетке с ячейкой radius: каждая точка сравнивается
+    только с точками своей и соседних ячеек, поэтому время растет
+    почти линейно с числом точек
+    """
+    MODES = ("repel", "bounce")
+    STRENGTH = {"repel": 600.0, "bounce": 1.0}
+    mode: str
+    radius: float
+    strength: float
+
+    def __init__(self, mode: str = "repel", radius: float = 24,
+                 strength: Optional[float] = None) -> None:
+        if mode not in self.MODES:
+            raise ValueError(f"unknown interaction mode {mode!r}")
+        self.mode = mode
+        self.radius = radius
+        self.strength = self.STRENGTH[mode] if strength is None else strength
+
+    def apply(self, knots: List[Knot], dt: float = 1.0) -> None:
+        """меняет скорости опорных точек кривых на шаг dt"""
+        if np is not None and all(knot.use_numpy for knot in knots):
+            self.__apply_numpy(knots, dt)
+        else:
+            self.__apply(knots, dt)
+
+    def _pairs(self, coords: Any) -> Tuple[Any, Any]:
+        """
+        возвращает номера i, j (i != j) пар точек из соседних ячеек;
+        каждая пара встречается один раз
+        """
+        cells = np.floor(coords / self.radius).astype(np.int64)
+        cells -= cells.min(axis=0) - 1
+        rows = int(cells[:, 1].max()) + 2
+        keys = cells[:, 0] * rows + cells[:, 1]
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+
+        first, second = [], []
+        # своя ячейка и половина соседних: каждая пара ячеек один раз
+        for dx, dy in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+            neighbours = keys + dx * rows + dy
+            start = np.searchsorted(sorted_keys, neighbours, "left")
+            counts = np.searchsorted(sorted_keys, neighbours, "right") - start
+            total = int(counts.sum())
+            if not total:
+                continue
+            i = np.repeat(np.arange(len(coords)), counts)
+            shift = np.arange(total) - np.repeat(np.cumsum(counts) - counts,
+                                                 counts)
+            j = order[np.repeat(start, counts) + shift]
+            if dx == 0 and dy == 0:
+                keep = i < j
+                i, j = i[keep], j[keep]
+            first.append(i)
+            second.append(j)
+        if not first:
+            empty = np.empty(0, dtype=np.intp)
+            return empty, empty
+        return np.concatenate(first), np.concatenate(second)
+
+    def __apply_numpy(self, knots: List[Knot], dt: float) -> None:
+        """векторный расчет для кривых в режиме use_numpy"""
+        knots = [knot for knot in knots if len(knot.points)]
+        if not knots:
+            return
+        coords = np.concatenate([knot.points for knot in knots])
+        speeds = np.concatenate([knot.speeds for knot in knots])
+        i, j = self._pairs(coords)
+        delta = coords[j] - coords[i]
+        dist = np.hypot(delta[:, 0], delta[:, 1])
+        near = (dist < self.radius) & (dist > 0)
+        i, j, delta, dist = i[near], j[near], delta[near], dist[near]
+        if not len(i):
+            return
+        normal = delta / dist[:, None]
+
+        if self.mode == "repel":
+            push = self.strength * (1 - dist / self.radius) * dt
+        else:
+            closing = ((speeds[j] - speeds[i]) * normal).sum(axis=1)
+            push = np.maximum(-closing, 0) * (1 + self.strength) / 2
+        impulse = normal * push[:, None]
+
+        count = len(coords)
+        change = np.empty_like(speeds)
+        for axis in range(2):
+            change[:, axis] = (
+                np.bincount(j, impulse[:, axis], count)
+                - np.bincount(i, impulse[:, axis], count))
+        start = 0
+        for knot in knots:
+            end = start + len(knot.points)
+            knot.speeds += change[start:end]
+            start = end
+
+    @staticmethod
+    def _xy(value: Any) -> Tuple[float, float]:
+        """координаты Vec2d или строки массива"""
+        if isinstance(value, Vec2d):
+            return value.x, value.y
+        return float(value[0]), float(value[1])
+
+    def __apply(self, knots: List[Knot], dt: float) -> None:
+        """поточечный расчет на Vec2d"""
+        anchors = [(knot, index) for knot in knots
+                   for index in range(len(knot.points))]
+        coords = [self._xy(knot.points[index]) for knot, index in anchors]
+        speeds = [self._xy(knot.speeds[index]) for knot, index in anchors]
+        changes = [[0.0, 0.0] for _ in anchors]
+
+        size = self.radius
+        cells = defaultdict(list)
+        for number, (x, y) in enumerate(coords):
+            cells[(int(x // size), int(y // size))].append(number)
+
+        for (cx, cy), members in cells.items():
+            for dx, dy in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+                others = cells.get((cx + dx, cy + dy))
+                if not others:
+                    continue
+                for a in members:
+                    ax, ay = coords[a]
+                    for b in others:
+                        if dx == 0 and dy == 0 and b <= a:
+                            continue
+                        nx = coords[b][0] - ax
+                        ny = coords[b][1] - ay
+                        dist = math.hypot(nx, ny)
+                        if not 0 < dist < size:
+                            continue
+                        nx /= dist
+                        ny /= dist
+                        if self.mode == "repel":
+                            push = self.strength * (1 - dist / size) * dt
+                        else:
+                            closing = ((speeds[b][0] - speeds[a][0]) * nx
+                                       + (speeds[b][1] - speeds[a][1]) * ny)
+                            if closing >= 0:
+                                continue
+                            push = -closing * (1 + self.strength) / 2
+                        changes[a][0] -= nx * push
+                        changes[a][1] -= ny * push
+                        changes[b][0] += nx * push
+                        changes[b][1] += ny * push
+
+        for (knot, index), (cx, cy) in zip(anchors, changes):
+            if not cx and not cy:
+                continue
+            if knot.use_numpy:
+                knot.speeds[index] += (cx, cy)
+            else:
+                speed = knot.speeds[index]
+                speed.x += cx
+                speed.y += cy
 
 
 class KnotsManager:
     """
     Инкапсулирует работу с несколькими кривыми: переключение, 
     перерасчет и рисование
+
+    Кривые лежат в списке knots не длиннее max и создаются по мере
+    надобности; перерасчет, поиск и рисование обходят только активные
+    кривые (с опорными точками). Очищенные кривые остаются в пуле
+    свободных и вместе со своими буферами отдаются add_knots
     """
     curr_knot: int
-    knots: defaultdict
+    knots: List[Knot]
 
-    def __init__(self, max: int, displ: Display) -> None:
-        self.knots = defaultdict(partial(Knot, display=displ))
+    def __init__(self, max: int, displ: Display, workers: int = 0,
+                 interaction: Optional[AnchorInteraction] = None,
+                 **knot_kwargs) -> None:
+        self.knots = []
         self.max = max
         self.curr_knot = -1
+        self.parallel = ParallelRecalc(workers) if workers > 0 else None
+        self.interaction = interaction
+        self.grid = AnchorGrid()
+        self.__factory = partial(Knot, display=displ, **knot_kwargs)
+        # упорядоченные множества активных и пустых кривых
+        self.__active = {}
+        self.__free = {}
+        self.__cursor = Vec2d.zero()
+
+    def __create(self) -> Knot:
+        """создает новую пустую кривую в конце списка"""
+        if len(self.knots) >= self.max:
+            raise IndexError(f"knots limit {self.max} reached")
+        knot = self.__factory()
+        knot.on_resize = self.__resized
+        self.knots.append(knot)
+        self.__free[knot] = None
+        return knot
+
+    def __resized(self, knot: Knot) -> None:
+        """переносит кривую между активными и пустыми"""
+        if len(knot.points):
+            if knot not in self.__active:
+                self.__free.pop(knot, None)
+                self.__active[knot] = None
+        elif knot not in self.__free:
+            self.__active.pop(knot, None)
+            self.__free[knot] = None
+
+    def knot(self, index: int) -> Knot:
+        """возвращает кривую index, создавая недостающие пустыми"""
+        if not 0 <= index < self.max:
+            raise IndexError(f"knot index {index} out of range")
+        while len(self.knots) <= index:
+            self.__create()
+        return self.knots[index]
+
+    @property
+    def active(self) -> List[Knot]:
+        """кривые, у которых есть опорные точки"""
+        return list(self.__active)
+
+    def current(self) -> Knot:
+        """возвращает текущую кривую"""
+        return self.knot(max(self.curr_knot, 0))
 
     def get_next(self) -> Knot:
         """Возвращает следующую кривую циклически"""
-        if self.curr_knot == max:
+        if self.curr_knot >= self.max - 1:
             self.curr_knot = 0
         else:
             self.curr_knot += 1
-        return self.knots[self.curr_knot] 
+        return self.knot(self.curr_knot)
 
     def get_prev(self) -> Knot:
         """возвращает предыдущую кривую"""
@@ -255,119 +1374,1607 @@ class KnotsManager:
             pass
         else:
             self.curr_knot -= 1
-        return self.knots[self.curr_knot]
+        return self.knot(self.curr_knot)
+
+    def add_knots(self, points: Any, speeds: Any,
+                  knot_points_count: Optional[int] = None) -> List[Knot]:
+        """
+        создает кривые по наборам опорных точек: points[i] и speeds[i] -
+        координаты (N, 2) i-й кривой; сначала занимаются пустые кривые
+        с их буферами, затем создаются новые в пределах max
+        """
+        free = list(self.__free)
+        missing = len(points) - len(free)
+        if missing > self.max - len(self.knots):
+            raise IndexError(f"knots limit {self.max} reached")
+        free.extend(self.__create() for _ in range(max(missing, 0)))
+
+        created = []
+        for knot, anchors, anchor_speeds in zip(free, points, speeds):
+            if knot_points_count is not None:
+                knot.knot_points_count = knot_points_count
+            knot.assign_points(anchors, anchor_speeds)
+            created.append(knot)
+        return created
+
+    def reset(self) -> None:
+        """очищает все кривые, оставляя их буферы для повторного заполнения"""
+        for knot in self.active:
+            knot.clear()
+
+    def recalc_all(self, dt: float = 1.0) -> None:
+        """
+        прерасчитывает все кривые; при заданном interaction
+        скорости опорных точек сначала меняются их взаимодействием
+        """
+        if self.interaction is not None:
+            self.interaction.apply(self.active, dt)
+        if self.parallel is not None:
+            self.parallel.recalc(self.active, dt)
+            return
+        for i in self.active:
+            i.recalc_points(dt)
+
+    def find_anchor(self, point: Vec2d, 
+                    radius: float = 5) -> Optional[Tuple[Knot, int]]:
+        """
+        возвращает кривую и номер ближайшей к point опорной точки
+        среди всех кривых на расстоянии не больше radius
+        """
+        self.grid.update(self.knots)
+        return self.grid.nearest(point, radius)
+
+    def delete_anchor(self, point: Vec2d, radius: float = 5) -> bool:
+        """удаляет ближайшую к point опорную точку любой кривой"""
+        found = self.find_anchor(point, radius)
+        if found is None:
+            return False
+        knot, index = found
+        knot.delete_base_point_at(index)
+        return True
 
-    def recalc_all(self) -> None:
-        """прерасчитывает все кривые"""
-        for i in self.knots.values():
-            i.recalc_points()
+    def hovered(self, cursor: Tuple[int, int],
+                radius: float = 5) -> Optional[Tuple[Knot, int]]:
+        """возвращает кривую и номер опорной точки под курсором"""
+        point = self.__cursor
+        point.x, point.y = cursor
+        return self.find_anchor(point, radius)
 
-    def draw_all(self, *args) -> None:
+    def highlight_anchor(self, cursor: Tuple[int, int],
+                         radius: float = 5) -> None:
+        """обводит опорную точку под курсором"""
+        found = self.hovered(cursor, radius)
+        if found is None:
+            return
+        knot, index = found
+        anchor = knot._int_pairs(knot.points[index:index + 1])[0]
+        rect = pygame.draw.circle(knot.display.get_surface(), 
+                                  (255, 255, 255), anchor, 8, 1)
+        knot.display.mark_dirty(rect)
+
+    def close(self) -> None:
+        """останавливает пул параллельного перерасчета"""
+        if self.parallel is not None:
+            self.parallel.close()
+            self.parallel = None
+
+    def draw_all(self, *args, alpha: float = 1.0) -> None:
         """
         рисует опорные точки и кривые, 
         
-        у текущей выбраной кривой подсвечивает точки зеленым
+        у текущей выбраной кривой подсвечивает точки зеленым,
+        alpha - доля шага симуляции для интерполяции положений
         """
-        i = 0
-        for knot in self.knots.values():
-            if i == self.curr_knot:
-                knot.draw_points(color=(148, 255, 11))
+        current = (self.knots[self.curr_knot] 
+                   if 0 <= self.curr_knot < len(self.knots) else None)
+        for knot in self.active:
+            if knot is current:
+                knot.draw_points(color=(148, 255, 11), alpha=alpha)
             else:
-                knot.draw_points()
-            knot.draw_knot(*args)
-            i += 1
-
-
-def draw_help():
-    """функция отрисовки экрана справки программы"""
-    gameDisplay.fill((50, 50, 50))
-    data = []
-    data.append(["F1", "Show Help"])
-    data.append(["R", "Restart"])
-    data.append(["P", "Pause/Play"])
-    data.append(["Num+", "More points"])
-    data.append(["Num-", "Less points"])
-    data.append(["→", "Next Knot"])
-    data.append(["←", "Previous Knot"])
-    data.append(["↑", "Increase speed"])
-    data.append(["↓", "Decrease speed"])
-    data.append(["", ""])
-    data.append([str(knot.knot_points_count), "Current points"])
-
-    pygame.draw.lines(gameDisplay.get_surface(), (255, 50, 50, 255), True, [
-        (0, 0), (800, 0), (800, 600), (0, 600)], 5)
-    for i, text in enumerate(data):
-        gameDisplay.blit(
-                COURIER.render(text[0], True, (128, 128, 255)), 
-                (100, 100 + 30 * i)
-                )
-        gameDisplay.blit(
-                SERIF.render(text[1], True, (128, 128, 255)),
-                (200, 100 + 30 * i)
-                )
+                knot.draw_points(alpha=alpha)
+            knot.draw_knot(*args, alpha=alpha)
+
+
+class SharedKnotBuffer:
+    """
+    Блок разделяемой памяти одной кривой: опорные точки, скорости 
+    и сегменты кривой с запасом на capacity опорных точек
+    """
+    shm: Any
+    capacity: int
+    samples: int
+
+    def __init__(self, capacity: int, samples: int) -> None:
+        self.capacity = capacity
+        self.samples = samples
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=capacity * (4 + 2 * samples) * 8)
+        self.points = self.speeds = self.segments = None
+
+    @staticmethod
+    def views(buf: Any, count: int, capacity: int,
+              samples: int) -> Tuple[Any, Any, Any]:
+        """возвращает массивы точек, скоростей и сегментов поверх buf"""
+        floats = np.ndarray((capacity * (4 + 2 * samples),), buffer=buf)
+        points = floats[:2 * capacity].reshape(capacity, 2)[:count]
+        speeds = floats[2 * capacity:4 * capacity].reshape(capacity, 2)[:count]
+        segments = floats[4 * capacity:].reshape(capacity, samples, 2)[:count]
+        return points, speeds, segments
+
+    def bind(self, knot: Knot) -> None:
+        """
+        переносит точки и скорости кривой в разделяемую память,
+        если кривая еще не работает с ее массивами
+        """
+        if knot.points is self.points and knot.speeds is self.speeds:
+            return
+        self.points, self.speeds, self.segments = self.views(
+            self.shm.buf, len(knot.points), self.capacity, self.samples)
+        self.points[:] = knot.points
+        self.speeds[:] = knot.speeds
+        knot.points = self.points
+        knot.speeds = self.speeds
+
+    def task(self, dt: float, width: int, height: int) -> tuple:
+        """описание задачи для процесса-исполнителя"""
+        return (self.shm.name, len(self.points), self.capacity, 
+                self.samples, dt, width, height)
+
+    def release(self) -> None:
+        """удаляет блок; память освобождается, когда исчезнут все виды"""
+        self.points = self.speeds = self.segments = None
+        self.shm.unlink()
+
+
+class ParallelRecalc:
+    """
+    Параллельный перерасчет кривых в пуле процессов
+
+    Точки, скорости и сегменты каждой кривой лежат в разделяемой памяти,
+    процессы считают движение и кривую прямо в ней, а кривые получают
+    готовые сегменты без копирования. Вычисления те же, что и при
+    последовательном перерасчете, поэтому результат совпадает побитно
+    """
+    workers: int
+
+    def __init__(self, workers: Optional[int] = None) -> None:
+        if np is None:
+            raise ImportError("numpy is required for parallel recalculation")
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise ValueError("parallel recalculation needs the fork "
+                             "start method, unavailable on this platform")
+        self.workers = workers or os.cpu_count() or 1
+        # общий с исполнителями трекер, иначе каждый из них
+        # удалит подключенные блоки памяти при своем завершении
+        resource_tracker.ensure_running()
+        self.__pool = multiprocessing.get_context("fork").Pool(self.workers)
+        self.__buffers = {}
+        self.__retired = []
+
+    @staticmethod
+    def _recalc_shared(task: tuple) -> None:
+        """перерасчет одной кривой в процессе-исполнителе"""
+        name, count, capacity, samples, dt, width, height = task
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            points, speeds, segments = SharedKnotBuffer.views(
+                shm.buf, count, capacity, samples)
+            Polyline._move_arrays(points, speeds, dt, width, height)
+            segments[:] = Knot._segment_points(
+                points, np.arange(count), samples)
+            del points, speeds, segments
+        finally:
+            shm.close()
+
+    def __buffer(self, knot: Knot) -> SharedKnotBuffer:
+        """возвращает блок разделяемой памяти кривой, при нужде новый"""
+        buffer = self.__buffers.get(knot)
+        count = len(knot.points)
+        if (buffer is None or buffer.capacity < count
+                or buffer.samples != knot.samples):
+            if buffer is not None:
+                self.__retire(buffer)
+            buffer = SharedKnotBuffer(max(2 * count, 16), knot.samples)
+            self.__buffers[knot] = buffer
+        buffer.bind(knot)
+        return buffer
+
+    def __retire(self, buffer: SharedKnotBuffer) -> None:
+        """откладывает закрытие блока, пока на него есть ссылки"""
+        buffer.release()
+        self.__retired.append(buffer.shm)
+
+    def __close_retired(self) -> None:
+        still_used = []
+        for shm in self.__retired:
+            try:
+                shm.close()
+            except BufferError:
+                still_used.append(shm)
+        self.__retired = still_used
+
+    def recalc(self, knots: List[Knot], dt: float = 1.0) -> None:
+        """перерасчитывает кривые, распределяя их по процессам"""
+        self.__close_retired()
+        shared = []
+        for knot in knots:
+            if (not knot.use_numpy or knot.tolerance is not None 
+                    or len(knot.points) < 3):
+                knot.recalc_points(dt)
+                continue
+            buffer = self.__buffer(knot)
+            knot.version += 1
+            knot.prev_points = knot._copy_points(knot.points,
+                                                 knot.prev_points)
+            knot._keep_prev_knot_points()
+            shared.append((knot, buffer))
+
+        if not shared:
+            return
+        tasks = [buffer.task(dt, knot.display.width, knot.display.height)
+                 for knot, buffer in shared]
+        chunksize = -(-len(tasks) // self.workers)
+        self.__pool.map(self._recalc_shared, tasks, chunksize)
+        for knot, buffer in shared:
+            knot._adopt_segments(buffer.segments)
+
+    def close(self) -> None:
+        """
+        останавливает пул и возвращает кривым 
+        собственные копии точек и сегментов
+        """
+        self.__pool.close()
+        self.__pool.join()
+        for knot, buffer in self.__buffers.items():
+            if knot.points is buffer.points:
+                knot.points = knot.points.copy()
+                knot.speeds = knot.speeds.copy()
+            if knot._segments is buffer.segments:
+                knot._adopt_segments(buffer.segments.copy())
+            self.__retire(buffer)
+        self.__buffers.clear()
+        self.__close_retired()
+
+
+class SceneFile:
+    """
+    Сохранение и загрузка всех кривых KnotsManager в бинарном формате
+
+    Формат (little-endian): заголовок MAGIC, версия, число кривых, 
+    номер текущей кривой; затем таблица кривых (число опорных точек, 
+    knot_points_count, смещение данных) и данные - float64 координаты 
+    точек и скоростей каждой кривой. При загрузке с numpy файл 
+    отображается в память (copy-on-write), и массивы кривых 
+    ссылаются прямо на его страницы без разбора точек
+    """
+    MAGIC = b"KNOT"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHHIi")
+    ENTRY = struct.Struct("<IIQ")
+
+    @staticmethod
+    def save(manager: KnotsManager, path: str) -> None:
+        """записывает сцену в файл path"""
+        # пишем во временный файл: загруженные кривые могут ссылаться
+        # на страницы прежнего файла, его нельзя обрезать на месте
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as scene:
+            SceneFile.dump(manager, scene)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def dump(manager: KnotsManager, stream: BinaryIO) -> None:
+        """пишет сцену в открытый двоичный поток stream"""
+        knots = manager.knots
+        header = SceneFile.HEADER
+        entry = SceneFile.ENTRY
+        offset = header.size + entry.size * len(knots)
+        table = []
+        for knot in knots:
+            table.append(entry.pack(
+                len(knot.points), knot.knot_points_count, offset))
+            offset += len(knot.points) * 4 * 8
+
+        stream.write(header.pack(SceneFile.MAGIC, SceneFile.VERSION, 0,
+                                 len(knots), manager.curr_knot))
+        stream.writelines(table)
+        for knot in knots:
+            for data in (knot.points, knot.speeds):
+                if np is not None and isinstance(data, np.ndarray):
+                    stream.write(data.astype("<f8").tobytes())
+                else:
+                    coords = array("d", [c for vec in data 
+                                         for c in (vec.x, vec.y)])
+                    if sys.byteorder == "big":
+                        coords.byteswap()
+                    stream.write(coords.tobytes())
+
+    @staticmethod
+    def load(manager: KnotsManager, path: str) -> None:
+        """
+        заменяет кривые manager сценой из файла path; поврежденный
+        файл или сцена больше manager.max дают ValueError до того,
+        как текущие кривые будут затронуты
+        """
+        with open(path, "rb") as scene:
+            size = os.fstat(scene.fileno()).st_size
+            head = scene.read(SceneFile.HEADER.size +
+                              SceneFile.ENTRY.size * manager.max)
+            curr_knot, table = SceneFile.__table(path, head, size,
+                                                 manager.max)
+            raw = None
+            if np is None:
+                scene.seek(0)
+                raw = scene.read()
+        data = None
+        if np is not None and any(anchors for anchors, _, _ in table):
+            data = np.memmap(path, dtype="<f8", mode="c",
+                             shape=(size // 8,))
+        SceneFile.__apply(manager, curr_knot, table, data, raw)
+
+    @staticmethod
+    def load_bytes(manager: KnotsManager, scene: bytes,
+                   name: str = "scene") -> None:
+        """как load, но берет сцену из байтов, записанных dump"""
+        curr_knot, table = SceneFile.__table(name, scene, len(scene),
+                                             manager.max)
+        data = None
+        if np is not None:
+            data = np.frombuffer(bytearray(scene[:len(scene) // 8 * 8]),
+                                 dtype="<f8")
+        SceneFile.__apply(manager, curr_knot, table, data, scene)
+
+    @staticmethod
+    def __table(name: str, head: bytes, size: int,
+                limit: int) -> Tuple[int, List[Tuple[int, int, int]]]:
+        """
+        разбирает заголовок и таблицу кривых из начала сцены head
+        и проверяет, что данные всех кривых лежат в пределах size байт
+        """
+        header = SceneFile.HEADER
+        entry = SceneFile.ENTRY
+        if len(head) < header.size:
+            raise ValueError(f"{name}: not a knots scene")
+        magic, version, _, count, curr_knot = header.unpack_from(head)
+        if magic != SceneFile.MAGIC:
+            raise ValueError(f"{name}: not a knots scene")
+        if version != SceneFile.VERSION:
+            raise ValueError(f"{name}: unsupported scene version {version}")
+        if count > limit:
+            raise ValueError(f"{name}: {count} knots, at most {limit} allowed")
+        if not 0 <= curr_knot < count:
+            raise ValueError(f"{name}: current knot {curr_knot} "
+                             f"out of {count}")
+        data_start = header.size + entry.size * count
+        if len(head) < data_start or size < data_start:
+            raise ValueError(f"{name}: truncated knot table")
+        table = list(entry.iter_unpack(head[header.size:data_start]))
+        for anchors, knot_points_count, offset in table:
+            if (not 1 <= knot_points_count <= Knot.MAX_KNOT_POINTS
+                    or offset % 8 or offset < data_start
+                    or offset + anchors * 4 * 8 > size):
+                raise ValueError(f"{name}: corrupt knot table")
+        return curr_knot, table
+
+    @staticmethod
+    def __apply(manager: KnotsManager, curr_knot: int,
+                table: List[Tuple[int, int, int]], data: Any,
+                raw: Optional[bytes]) -> None:
+        """
+        заменяет кривые manager проверенной таблицей; data - вся сцена
+        как массив float64, raw - ее байты, если numpy нет
+        """
+        manager.reset()
+        for i, (anchors, knot_points_count, offset) in enumerate(table):
+            knot = manager.knot(i)
+            knot.knot_points_count = knot_points_count
+            start = offset // 8
+            if data is not None and knot.use_numpy:
+                points = data[start:start + 2 * anchors].reshape(anchors, 2)
+                speeds = data[start + 2 * anchors:
+                              start + 4 * anchors].reshape(anchors, 2)
+            elif data is not None:
+                points = SceneFile.__vectors(
+                    data[start:start + 2 * anchors].tolist())
+                speeds = SceneFile.__vectors(
+                    data[start + 2 * anchors:start + 4 * anchors].tolist())
+            else:
+                coords = array("d")
+                coords.frombytes(raw[offset:offset + anchors * 4 * 8])
+                if sys.byteorder == "big":
+                    coords.byteswap()
+                points = SceneFile.__vectors(coords[:2 * anchors])
+                speeds = SceneFile.__vectors(coords[2 * anchors:])
+            if anchors == 0:
+                knot.clear()
+            else:
+                knot.set_points(points, speeds)
+        manager.curr_knot = curr_knot
+
+    @staticmethod
+    def __vectors(coords: Any) -> List[Vec2d]:
+        return [Vec2d(coords[i], coords[i + 1]) 
+                for i in range(0, len(coords), 2)]
+
+
+class FrameScheduler:
+    """
+    Планировщик кадров: симуляция идет фиксированными шагами 
+    step = 1 / sim_rate, а отрисовка - с частотой не выше fps_cap
+
+    tick ждет начала следующего кадра и возвращает число шагов 
+    симуляции и долю следующего шага для интерполяции при отрисовке
+    """
+    fps_cap: int
+    step: float
+    max_steps: int
+
+    def __init__(self, fps_cap: int = 60, sim_rate: int = 60,
+                 max_steps: int = 5) -> None:
+        if fps_cap < 0 or sim_rate <= 0:
+            raise ValueError(f"bad rates: fps_cap={fps_cap}, "
+                             f"sim_rate={sim_rate}")
+        self.fps_cap = fps_cap
+        self.step = 1 / sim_rate
+        self.max_steps = max_steps
+        self.__clock = pygame.time.Clock()
+        self.__accumulator = 0.0
+
+    @staticmethod
+    def fps(value: str) -> int:
+        """разбирает ограничение частоты кадров для argparse: целое >= 0"""
+        try:
+            fps = int(value)
+        except ValueError:
+            fps = None
+        if fps is None or fps < 0:
+            raise argparse.ArgumentTypeError(
+                f"fps must be a non-negative integer, got {value!r}")
+        return fps
+
+    @staticmethod
+    def sim_rate(value: str) -> int:
+        """разбирает частоту симуляции для argparse: целое больше 0"""
+        try:
+            rate = int(value)
+        except ValueError:
+            rate = None
+        if rate is None or rate <= 0:
+            raise argparse.ArgumentTypeError(
+                f"simulation rate must be a positive integer, got {value!r}")
+        return rate
+
+    def tick(self) -> Tuple[int, float]:
+        """ожидает следующий кадр, возвращает (шаги, alpha)"""
+        self.__accumulator += self.__clock.tick(self.fps_cap) / 1000
+        steps = int(self.__accumulator // self.step)
+        if steps > self.max_steps:
+            # не догоняем отставание, иначе медленные кадры копятся
+            steps = self.max_steps
+            self.__accumulator = 0.0
+        else:
+            self.__accumulator -= steps * self.step
+        return steps, self.__accumulator / self.step
+
+
+class CachedLayer:
+    """
+    Слой оверлея, закэшированный в отдельной поверхности
+
+    render вызывается только при смене ключа: текста, шрифтов 
+    или размера экрана
+    """
+
+    def __init__(self, render: Callable[..., pygame.Surface]) -> None:
+        self.__render = render
+        self.__key = None
+        self.__surface = None
+
+    def get(self, *key: Any) -> pygame.Surface:
+        """возвращает поверхность слоя, перерисовывая ее при смене key"""
+        if self.__surface is None or key != self.__key:
+            self.__surface = self.__render(*key)
+            self.__key = key
+        return self.__surface
+
+
+class FrameProfiler:
+    """
+    Замеряет длительность фаз каждого кадра
+
+    хранит скользящие суммы за последние window кадров, 
+    выводит FPS и разбивку по фазам на экран (HUD) 
+    и при необходимости пишет замеры каждого кадра в CSV
+    """
+    PHASES = ("wait", "events", "recalc", "draw", "help", "hud", "flip")
+    HUD_REFRESH = 10
+    show_hud: bool
+
+    def __init__(self, window: int = 120,
+                 csv_path: Optional[str] = None) -> None:
+        self.window = window
+        self.show_hud = False
+        self.__hud = CachedLayer(self.__render_hud)
+        self.__hud_lines = None
+        self.__samples = deque()
+        self.__sums = dict.fromkeys(self.PHASES + ("total",), 0.0)
+        self.__current = dict.fromkeys(self.PHASES, 0.0)
+        self.__frame = 0
+        self.__frame_start = self.__last = time.perf_counter()
+        self.__csv_file = None
+        self.__csv = None
+        if csv_path is not None:
+            self.__csv_file = open(csv_path, "w", newline="")
+            self.__csv = csv.writer(self.__csv_file)
+            self.__csv.writerow(("frame", "total_ms") + 
+                                tuple(f"{phase}_ms" for phase in self.PHASES))
+
+    def start_frame(self) -> None:
+        """начинает замер кадра"""
+        self.__current = dict.fromkeys(self.PHASES, 0.0)
+        self.__frame_start = self.__last = time.perf_counter()
+
+    def mark(self, phase: str) -> None:
+        """относит время с прошлой отметки к фазе phase"""
+        now = time.perf_counter()
+        self.__current[phase] += now - self.__last
+        self.__last = now
+
+    def end_frame(self) -> None:
+        """завершает замер кадра и обновляет скользящую статистику"""
+        sample = self.__current
+        sample["total"] = self.__last - self.__frame_start
+        if len(self.__samples) == self.window:
+            old = self.__samples.popleft()
+            for key, value in old.items():
+                self.__sums[key] -= value
+        self.__samples.append(sample)
+        for key, value in sample.items():
+            self.__sums[key] += value
+
+        self.__frame += 1
+        if self.__csv is not None:
+            self.__csv.writerow(
+                (self.__frame, f"{sample['total'] * 1000:.3f}") + 
+                tuple(f"{sample[phase] * 1000:.3f}" for phase in self.PHASES))
+
+    def work_time(self) -> float:
+        """время последнего кадра без ожидания планировщика, в секундах"""
+        if not self.__samples:
+            return 0.0
+        sample = self.__samples[-1]
+        return sample["total"] - sample["wait"]
+
+    def mean_ms(self, phase: str = "total") -> float:
+        """возвращает среднее время фазы в миллисекундах"""
+        if not self.__samples:
+            return 0.0
+        return self.__sums[phase] / len(self.__samples) * 1000
+
+    @property
+    def fps(self) -> float:
+        """частота кадров по скользящему окну"""
+        total = self.__sums["total"]
+        return len(self.__samples) / total if total > 0 else 0.0
+
+    def draw_hud(self, display: Display, font: pygame.font.Font) -> None:
+        """
+        рисует FPS и разбивку кадра по фазам в левом верхнем углу;
+        цифры обновляются раз в HUD_REFRESH кадров
+        """
+        if self.__hud_lines is None or self.__frame % self.HUD_REFRESH == 0:
+            lines = [f"FPS {self.fps:6.1f}"]
+            lines.extend(f"{phase:<7}{self.mean_ms(phase):6.2f} ms"
+                         for phase in self.PHASES)
+            self.__hud_lines = tuple(lines)
+        layer = self.__hud.get(font, self.__hud_lines)
+        display.mark_dirty(display.blit(layer, (0, 0)))
+
+    @staticmethod
+    def __render_hud(font: pygame.font.Font, 
+                     lines: Tuple[str, ...]) -> pygame.Surface:
+        step = font.get_linesize()
+        rendered = [font.render(line, True, (255, 255, 0)) for line in lines]
+        layer = pygame.Surface((
+            max(text.get_width() for text in rendered) + 20, 
+            step * len(lines) + 10))
+        layer.fill((30, 30, 30))
+        for i, text in enumerate(rendered):
+            layer.blit(text, (10, 5 + step * i))
+        return layer
+
+    def close(self) -> None:
+        """закрывает CSV файл"""
+        if self.__csv_file is not None:
+            self.__csv_file.close()
+            self.__csv_file = None
+            self.__csv = None
+
+
+class QualityGovernor:
+    """
+    Подстраивает качество кривых под целевую частоту кадров
+
+    Следит за сглаженным временем кадра: если оно дольше бюджета
+    1 / target_fps больше чем на band в течение degrade_after кадров, 
+    повышает уровень упрощения (lod) одной кривой - сначала не текущих,
+    а если быстрее бюджета на band в течение restore_after кадров,
+    возвращает качество - сначала текущей кривой. Зазор band и разное 
+    число кадров не дают качеству колебаться
+    """
+    target_fps: float
+    max_lod: int
+
+    def __init__(self, target_fps: float, max_lod: int = 5, 
+                 band: float = 0.15, degrade_after: int = 10,
+                 restore_after: int = 60, smoothing: float = 0.1) -> None:
+        self.target_fps = target_fps
+        self.max_lod = max_lod
+        self.band = band
+        self.degrade_after = degrade_after
+        self.restore_after = restore_after
+        self.smoothing = smoothing
+        self.frame_time = 0.0
+        self.__over = 0
+        self.__under = 0
+
+    def update(self, frame_time: float, knots: List[Knot],
+               focus: Optional[Knot]) -> None:
+        """учитывает время очередного кадра и при нужде меняет качество"""
+        self.frame_time += (frame_time - self.frame_time) * self.smoothing
+        budget = 1 / self.target_fps
+        if self.frame_time > budget * (1 + self.band):
+            self.__over += 1
+            self.__under = 0
+        elif self.frame_time < budget * (1 - self.band):
+            self.__under += 1
+            self.__over = 0
+        else:
+            self.__over = self.__under = 0
+
+        if self.__over >= self.degrade_after:
+            self.__over = 0
+            self.__degrade(knots, focus)
+        elif self.__under >= self.restore_after:
+            self.__under = 0
+            self.__restore(knots, focus)
+
+    def __degrade(self, knots: List[Knot], focus: Optional[Knot]) -> None:
+        """упрощает наименее упрощенную не текущую кривую"""
+        candidates = [knot for knot in knots 
+                      if knot is not focus and knot.lod < self.max_lod 
+                      and len(knot.points) >= 3]
+        if candidates:
+            self.__set_lod(min(candidates, key=lambda knot: knot.lod), 1)
+        elif focus is not None and focus.lod < self.max_lod:
+            self.__set_lod(focus, 1)
+
+    def __restore(self, knots: List[Knot], focus: Optional[Knot]) -> None:
+        """возвращает качество текущей, затем самой упрощенной кривой"""
+        if focus is not None and focus.lod > 0:
+            self.__set_lod(focus, -1)
+            return
+        degraded = [knot for knot in knots if knot.lod > 0]
+        if degraded:
+            self.__set_lod(max(degraded, key=lambda knot: knot.lod), -1)
+
+    @staticmethod
+    def __set_lod(knot: Knot, step: int) -> None:
+        knot.lod += step
+        knot.recalc_knot()
+
+
+class SessionRecorder:
+    """
+    Журнал сеанса для детерминированного воспроизведения
+
+    Пишет seed генератора случайных чисел, параметры симуляции и режим
+    dirty_rects, от которого зависит пропуск кадров на паузе, для
+    каждого кадра - число шагов симуляции, долю шага для интерполяции,
+    положение курсора и обработанные события ввода (клавиши, кнопки
+    мыши, выход), а также байты каждой загруженной сцены - начальной
+    и по клавише L - в компактном бинарном формате
+    """
+    MAGIC = b"KREC"
+    VERSION = 3
+    HEADER = struct.Struct("<4sHIIHH")
+    OPTIONS = struct.Struct("<dBddd?")
+    FRAME = struct.Struct("<BBd?hh")
+    KEY = struct.Struct("<Bi")
+    MOUSE = struct.Struct("<BBhh")
+    QUIT = struct.Struct("<B")
+    SCENE = struct.Struct("<BI")
+    TAG_FRAME, TAG_KEY, TAG_MOUSE, TAG_QUIT, TAG_SCENE = range(5)
+
+    def __init__(self, path: str, seed: int, sim_rate: int,
+                 screen_size: Tuple[int, int], tolerance: Optional[float],
+                 interaction: Optional[str], interaction_radius: float,
+                 interaction_strength: Optional[float],
+                 trail: Optional[float], dirty_rects: bool) -> None:
+        nan = float("nan")
+        self.__file = open(path, "wb")
+        self.__file.write(self.HEADER.pack(
+            self.MAGIC, self.VERSION, seed, sim_rate, *screen_size))
+        self.__file.write(self.OPTIONS.pack(
+            nan if tolerance is None else tolerance,
+            0 if interaction is None else
+            AnchorInteraction.MODES.index(interaction) + 1,
+            interaction_radius,
+            nan if interaction_strength is None else interaction_strength,
+            nan if trail is None else trail, dirty_rects))
+
+    def frame(self, steps: int, alpha: float,
+              cursor: Optional[Tuple[int, int]]) -> None:
+        """начинает запись кадра; cursor - положение мыши или None"""
+        self.__file.write(self.FRAME.pack(
+            self.TAG_FRAME, steps, alpha, cursor is not None,
+            *(cursor or (0, 0))))
+
+    def event(self, event: pygame.event.Event) -> None:
+        """записывает обработанное событие текущего кадра"""
+        if event.type == pygame.KEYDOWN:
+            self.__file.write(self.KEY.pack(self.TAG_KEY, event.key))
+        elif event.type == pygame.MOUSEBUTTONDOWN:
+            self.__file.write(self.MOUSE.pack(
+                self.TAG_MOUSE, event.button, *event.pos))
+        elif event.type == pygame.QUIT:
+            self.__file.write(self.QUIT.pack(self.TAG_QUIT))
+
+    def scene(self, data: bytes) -> None:
+        """записывает загруженную сцену, пустую, если загрузки не было"""
+        self.__file.write(self.SCENE.pack(self.TAG_SCENE, len(data)))
+        self.__file.write(data)
+
+    def close(self) -> None:
+        self.__file.close()
+
+    @staticmethod
+    def read(path: str) -> Tuple[Tuple[int, int, Tuple[int, int], dict],
+                                 deque, Any]:
+        """
+        возвращает (seed, sim_rate, screen_size, options), очередь
+        записанных сцен и итератор кадров (steps, alpha, cursor, events);
+        options - параметры симуляции по именам опций командной строки.
+        Сцены кадра попадают в очередь до того, как кадр будет выдан
+        """
+        with open(path, "rb") as log:
+            data = log.read()
+        header = SessionRecorder.HEADER
+        options = SessionRecorder.OPTIONS
+        if len(data) < header.size:
+            raise ValueError(f"{path}: not a session log")
+        magic, version, seed, sim_rate, width, height = \
+            header.unpack_from(data)
+        if magic != SessionRecorder.MAGIC:
+            raise ValueError(f"{path}: not a session log")
+        if version != SessionRecorder.VERSION:
+            raise ValueError(f"{path}: unsupported log version {version}")
+        if sim_rate == 0:
+            raise ValueError(f"{path}: bad simulation rate")
+        if len(data) < header.size + options.size:
+            raise ValueError(f"{path}: truncated session log")
+        tolerance, interaction, radius, strength, trail, dirty_rects = \
+            options.unpack_from(data, header.size)
+        settings = {
+            "tolerance": None if math.isnan(tolerance) else tolerance,
+            "interaction": AnchorInteraction.MODES[interaction - 1]
+            if interaction else None,
+            "interaction_radius": radius,
+            "interaction_strength": None if math.isnan(strength)
+            else strength,
+            "trail": None if math.isnan(trail) else trail,
+            "dirty_rects": dirty_rects,
+        }
+        scenes = deque()
+        frames = SessionRecorder.__frames(
+            data, header.size + options.size, scenes)
+        # начальная сцена записана до первого кадра: читаем до него
+        next(frames)
+        return (seed, sim_rate, (width, height), settings), scenes, frames
+
+    @staticmethod
+    def __frames(data: bytes, offset: int, scenes: deque) -> Any:
+        # первым выдается None, когда начальные сцены уже в очереди
+        frame = None
+        first = True
+        while offset < len(data):
+            tag = data[offset]
+            if tag == SessionRecorder.TAG_FRAME:
+                if first:
+                    yield None
+                    first = False
+                if frame is not None:
+                    yield frame
+                _, steps, alpha, focused, x, y = \
+                    SessionRecorder.FRAME.unpack_from(data, offset)
+                frame = (steps, alpha, (x, y) if focused else None, [])
+                offset += SessionRecorder.FRAME.size
+            elif tag == SessionRecorder.TAG_KEY:
+                _, key = SessionRecorder.KEY.unpack_from(data, offset)
+                frame[3].append(pygame.event.Event(pygame.KEYDOWN, key=key))
+                offset += SessionRecorder.KEY.size
+            elif tag == SessionRecorder.TAG_MOUSE:
+                _, button, x, y = SessionRecorder.MOUSE.unpack_from(
+                    data, offset)
+                frame[3].append(pygame.event.Event(
+                    pygame.MOUSEBUTTONDOWN, button=button, pos=(x, y)))
+                offset += SessionRecorder.MOUSE.size
+            elif tag == SessionRecorder.TAG_QUIT:
+                frame[3].append(pygame.event.Event(pygame.QUIT))
+                offset += SessionRecorder.QUIT.size
+            elif tag == SessionRecorder.TAG_SCENE:
+                _, size = SessionRecorder.SCENE.unpack_from(data, offset)
+                offset += SessionRecorder.SCENE.size
+                scenes.append(data[offset:offset + size])
+                offset += size
+            else:
+                raise ValueError(f"corrupt session log at byte {offset}")
+        if first:
+            yield None
+        if frame is not None:
+            yield frame
+
+
+class FrameExporter:
+    """
+    Запись кадров на диск последовательностью изображений
+
+    Главный поток только копирует пиксели кадра в ограниченную очередь,
+    а кодирование и запись идут в фоновых потоках
+    """
+    directory: str
+
+    def __init__(self, directory: str, extension: str = "png",
+                 threads: int = 2, queue_size: int = 32) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.extension = extension
+        self.__queue = queue.Queue(queue_size)
+        self.__error = None
+        self.__count = 0
+        self.__threads = [threading.Thread(target=self.__work, daemon=True)
+                          for _ in range(threads)]
+        for thread in self.__threads:
+            thread.start()
+
+    def submit(self, surface: pygame.Surface) -> None:
+        """ставит копию кадра в очередь на запись"""
+        if self.__error is not None:
+            raise self.__error
+        self.__count += 1
+        self.__queue.put((self.__count, surface.get_size(),
+                          pygame.image.tobytes(surface, "RGB")))
+
+    def __work(self) -> None:
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                return
+            index, size, pixels = item
+            try:
+                image = pygame.image.frombytes(pixels, size, "RGB")
+                pygame.image.save(image, os.path.join(
+                    self.directory, f"frame_{index:06d}.{self.extension}"))
+            except Exception as error:
+                self.__error = error
+
+    def close(self) -> None:
+        """дожидается записи всех кадров"""
+        for _ in self.__threads:
+            self.__queue.put(None)
+        for thread in self.__threads:
+            thread.join()
+        if self.__error is not None:
+            raise self.__error
+
+
+class CommandServer:
+    """
+    Управляющий Unix-сокет для скриптов
+
+    Клиенты шлют построчные текстовые команды (см. parse); asyncio-сервер
+    в отдельном потоке разбирает каждую строку, отвечает "ok" или
+    "error ..." и кладет команду в deque, append и popleft которой
+    потокобезопасны без блокировок. Главный цикл раз в кадр забирает
+    не больше batch команд, поэтому поток команд не тормозит отрисовку
+    """
+    LIMIT = 1e6
+    path: str
+    batch: int
+
+    def __init__(self, path: str, batch: int = 1000) -> None:
+        self.path = path
+        self.batch = batch
+        self.__commands = deque()
+        self.__loop = asyncio.new_event_loop()
+        self.__error = None
+        self.__ready = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+        self.__ready.wait()
+        if self.__error is not None:
+            raise self.__error
+
+    @staticmethod
+    def parse(line: str) -> Tuple[str, Tuple[Any, ...]]:
+        """
+        разбирает команду:
+
+            add X Y [VX VY]  опорная точка текущей кривой
+            remove X Y       удалить опорную точку рядом с (X, Y)
+            knot next|prev|N переключить кривую
+            speed FACTOR     умножить скорости текущей кривой
+            points N         knot_points_count текущей кривой
+            load [PATH]      загрузить сцену
+
+        Координаты и скорости - конечные числа не больше LIMIT
+        по модулю, N - не больше Knot.MAX_KNOT_POINTS
+        """
+        name, *words = line.split()
+        try:
+            if name == "add" and len(words) in (2, 4):
+                return name, CommandServer.__numbers(words)
+            if name == "remove" and len(words) == 2:
+                return name, CommandServer.__numbers(words)
+            if name == "knot" and len(words) == 1:
+                target = words[0]
+                if target in ("next", "prev"):
+                    return name, (target,)
+                if int(target) >= 0:
+                    return name, (int(target),)
+            if (name == "speed" and len(words) == 1 
+                    and 0 < float(words[0]) <= CommandServer.LIMIT):
+                return name, (float(words[0]),)
+            if (name == "points" and len(words) == 1
+                    and 0 < int(words[0]) <= Knot.MAX_KNOT_POINTS):
+                return name, (int(words[0]),)
+            if name == "load" and len(words) <= 1:
+                return name, tuple(words)
+        except ValueError:
+            pass
+        raise ValueError(f"bad command {line.strip()!r}")
+
+    @staticmethod
+    def __numbers(words: List[str]) -> Tuple[float, ...]:
+        """числа команды; nan, inf и слишком большие дают ValueError"""
+        numbers = tuple(float(word) for word in words)
+        if not all(math.isfinite(number) 
+                   and abs(number) <= CommandServer.LIMIT
+                   for number in numbers):
+            raise ValueError("number out of range")
+        return numbers
+
+    def drain(self) -> List[Tuple[str, Tuple[Any, ...]]]:
+        """забирает накопившиеся команды, не больше batch за раз"""
+        commands = self.__commands
+        return [commands.popleft()
+                for _ in range(min(self.batch, len(commands)))]
+
+    def __run(self) -> None:
+        loop = self.__loop
+        asyncio.set_event_loop(loop)
+        try:
+            server = loop.run_until_complete(
+                asyncio.start_unix_server(self.__client, self.path))
+        except (OSError, AttributeError) as error:
+            # AttributeError: в asyncio нет Unix-сокетов на этой платформе
+            self.__error = error if isinstance(error, OSError) else \
+                OSError("Unix domain sockets are not supported")
+            self.__ready.set()
+            loop.close()
+            return
+        self.__ready.set()
+        loop.run_forever()
+
+        server.close()
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        loop.run_until_complete(
+            asyncio.gather(*tasks, return_exceptions=True))
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+
+    async def __client(self, reader: asyncio.StreamReader,
+                       writer: asyncio.StreamWriter) -> None:
+        try:
+            async for line in reader:
+                text = line.decode(errors="replace").strip()
+                if not text or text.startswith("#"):
+                    continue
+                try:
+                    self.__commands.append(self.parse(text))
+                except ValueError as error:
+                    writer.write(f"error {error}\n".encode())
+                else:
+                    writer.write(b"ok\n")
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # close() отменяет задачи подключенных клиентов; задача,
+            # завершенная отменой, печатает ошибку через callback asyncio
+            pass
+        finally:
+            writer.close()
+
+    def close(self) -> None:
+        """останавливает сервер и удаляет файл сокета"""
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class FontCache:
+    """
+    Ленивая загрузка системных шрифтов
+
+    pygame.font.SysFont при первом вызове опрашивает весь список
+    шрифтов системы (на Linux - через fc-list), что заметно замедляет
+    запуск. Здесь шрифт ищется только при первом обращении к нему,
+    а найденный путь сохраняется в JSON-файле path, и следующие запуски
+    открывают файл шрифта сразу. Отсутствие шрифта тоже запоминается;
+    чтобы искать шрифты заново, файл кэша достаточно удалить
+    """
+    path: Optional[str]
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self.__paths = None
+        self.__fonts = {}
+
+    @staticmethod
+    def default_path() -> str:
+        """файл кэша в каталоге кэша пользователя (XDG_CACHE_HOME)"""
+        cache = (os.environ.get("XDG_CACHE_HOME")
+                 or os.path.join(os.path.expanduser("~"), ".cache"))
+        return os.path.join(cache, "myscreensaver", "fonts.json")
+
+    def __load(self) -> dict:
+        """читает кэш путей; пути к удаленным файлам отбрасываются"""
+        if self.__paths is not None:
+            return self.__paths
+        paths = {}
+        if self.path is not None:
+            try:
+                with open(self.path) as cache:
+                    paths = json.load(cache)
+            except (OSError, ValueError):
+                pass
+        if not isinstance(paths, dict):
+            paths = {}
+        self.__paths = {name: path for name, path in paths.items()
+                        if path is None or os.path.exists(path)}
+        return self.__paths
+
+    def __save(self) -> None:
+        """записывает кэш путей; ошибки записи не мешают работе"""
+        if self.path is None:
+            return
+        tmp_path = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp_path, "w") as cache:
+                json.dump(self.__paths, cache, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+    def resolve(self, name: str) -> Optional[str]:
+        """путь к файлу шрифта name или None, если в системе его нет"""
+        paths = self.__load()
+        if name not in paths:
+            paths[name] = pygame.font.match_font(name)
+            self.__save()
+        return paths[name]
+
+    def get(self, name: str, size: int) -> pygame.font.Font:
+        """
+        возвращает шрифт name размера size, как pygame.font.SysFont;
+        без такого шрифта в системе - шрифт pygame по умолчанию
+        """
+        font = self.__fonts.get((name, size))
+        if font is None:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            font = pygame.font.Font(self.resolve(name), size)
+            self.__fonts[(name, size)] = font
+        return font
+
+
+class StartupTimer:
+    """
+    Время запуска по этапам: от начала работы модуля через
+    отмеченные mark этапы до первого выведенного кадра
+    """
+
+    def __init__(self, started: float) -> None:
+        self.__marks = [("start", started)]
+
+    def mark(self, phase: str) -> None:
+        """отмечает конец этапа phase"""
+        self.__marks.append((phase, time.perf_counter()))
+
+    def report(self) -> str:
+        """длительности этапов и общее время в миллисекундах"""
+        parts = [f"{phase} {(end - start) * 1000:.1f} ms"
+                 for (_, start), (phase, end) 
+                 in zip(self.__marks, self.__marks[1:])]
+        total = self.__marks[-1][1] - self.__marks[0][1]
+        return ", ".join(parts + [f"total {total * 1000:.1f} ms"])
+
+
+class ScreenSaver:
+    """
+    Состояние заставки: обработка ввода, шаги симуляции и отрисовка
+    кадра; общее для живого цикла и воспроизведения журнала
+    """
+    display: Display
+    knots: KnotsManager
+    knot: Knot
+
+    def __init__(self, display: Display, knots: KnotsManager,
+                 profiler: FrameProfiler, help_overlay: HelpOverlay,
+                 scene_path: str, save_scenes: bool = True,
+                 recorder: Optional[SessionRecorder] = None,
+                 scenes: Optional[deque] = None) -> None:
+        """
+        recorder получает байты загружаемых сцен; при воспроизведении
+        scenes - очередь сцен из журнала, которые загружаются вместо
+        файла scene_path
+        """
+        self.display = display
+        self.knots = knots
+        self.profiler = profiler
+        self.help_overlay = help_overlay
+        self.scene_path = scene_path
+        self.save_scenes = save_scenes
+        self.recorder = recorder
+        self.scenes = scenes
+        self.knot = knots.get_next()
+        try:
+            if self.load_scene():
+                self.knot = knots.current()
+        except (OSError, ValueError) as error:
+            print(f"load: {error}", file=sys.stderr)
+        self.working = True
+        self.show_help = False
+        self.pause = True
+        self.hue = 0
+        self.color = pygame.Color(0)
+        self.redraw = True
+        self.hover = None
+
+    def load_scene(self) -> bool:
+        """
+        загружает сцену scene_path, если файл есть, и возвращает True,
+        если сцена загружена; при записи сеанса байты сцены попадают
+        в журнал, при воспроизведении сцена берется из журнала
+        """
+        if self.scenes is not None:
+            scene = self.scenes.popleft()
+            if scene:
+                SceneFile.load_bytes(self.knots, scene, self.scene_path)
+            return bool(scene)
+        if not os.path.exists(self.scene_path):
+            if self.recorder is not None:
+                self.recorder.scene(b"")
+            return False
+        if self.recorder is None:
+            SceneFile.load(self.knots, self.scene_path)
+            return True
+        scene = b""
+        try:
+            with open(self.scene_path, "rb") as file:
+                data = file.read()
+            SceneFile.load_bytes(self.knots, data, self.scene_path)
+            scene = data
+        finally:
+            self.recorder.scene(scene)
+        return True
+
+    def handle_event(self, event: pygame.event.Event) -> bool:
+        """обрабатывает событие, возвращает True для событий ввода"""
+        knots = self.knots
+        knot = self.knot
+        if event.type == pygame.QUIT:
+            self.working = False
+            return True
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_ESCAPE:
+                self.working = False
+            if event.key == pygame.K_r:
+                knot.clear()
+            if event.key == pygame.K_s and self.save_scenes:
+                SceneFile.save(knots, self.scene_path)
+            if event.key == pygame.K_l:
+                try:
+                    if self.load_scene():
+                        knot = knots.current()
+                except (OSError, ValueError) as error:
+                    print(f"load: {error}", file=sys.stderr)
+            if event.key == pygame.K_p:
+                self.pause = not self.pause
+            if (event.key == pygame.K_KP_PLUS 
+                    and knot.knot_points_count < Knot.MAX_KNOT_POINTS):
+                knot.knot_points_count += 1
+            if event.key == pygame.K_F1:
+                self.show_help = not self.show_help
+            if event.key == pygame.K_F2:
+                self.profiler.show_hud = not self.profiler.show_hud
+            if event.key == pygame.K_KP_MINUS:
+                knot.knot_points_count -= 1 if knot.knot_points_count > 1 else 0
+            if event.key == pygame.K_RIGHT:
+                knot = knots.get_next()
+            if event.key == pygame.K_LEFT:
+                knot = knots.get_prev()
+            if event.key == pygame.K_UP:
+                knot.scale_speeds(1.5)
+            if event.key == pygame.K_DOWN:
+                knot.scale_speeds(1 / 1.5)
+            self.knot = knot
+            return True
+                
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            if event.button == 1:
+                knot.add_base_point(
+                    Vec2d(*event.pos), 
+                    Vec2d(random.random() * POINT_SPEED, 
+                          random.random() * POINT_SPEED))
+            if event.button == 3:
+                knots.delete_anchor(Vec2d(*event.pos))
+            return True
+        return False
+
+    def execute(self, command: Tuple[str, Tuple[Any, ...]]) -> None:
+        """выполняет команду управляющего сокета (см. CommandServer)"""
+        knots = self.knots
+        knot = self.knot
+        name, args = command
+        try:
+            if name == "add":
+                x, y, *speed = args
+                if not speed:
+                    speed = (random.random() * POINT_SPEED,
+                             random.random() * POINT_SPEED)
+                knot.add_base_point(Vec2d(x, y), Vec2d(*speed))
+            elif name == "remove":
+                knots.delete_anchor(Vec2d(*args))
+            elif name == "knot" and args[0] == "next":
+                knot = knots.get_next()
+            elif name == "knot" and args[0] == "prev":
+                knot = knots.get_prev()
+            elif name == "knot":
+                knot = knots.knot(args[0])
+                knots.curr_knot = args[0]
+            elif name == "speed":
+                knot.scale_speeds(args[0])
+            elif name == "points":
+                knot.knot_points_count = args[0]
+            elif name == "load":
+                SceneFile.load(knots, args[0] if args else self.scene_path)
+                knot = knots.current()
+        except (OSError, ValueError, IndexError) as error:
+            print(f"{name}: {error}", file=sys.stderr)
+        self.knot = knot
+
+    def frame(self, steps: int, step: float, alpha: float, handled: bool,
+              cursor: Optional[Tuple[int, int]] = None) -> bool:
+        """
+        делает steps шагов симуляции и рисует кадр, подсвечивая опорную
+        точку под курсором cursor; возвращает False, если кадр пропущен,
+        потому что на паузе ничего не менялось
+        """
+        profiler = self.profiler
+        hover = None
+        if cursor is not None:
+            hover = self.knots.hovered(cursor)
+        if (self.display.dirty_rects and self.pause and not handled
+                and not self.redraw and hover == self.hover):
+            # на паузе без ввода и смены точки под курсором
+            # кадр не меняется
+            return False
+        self.redraw = False
+        self.hover = hover
+
+        if self.pause:
+            alpha = 1.0
+        else:
+            for _ in range(steps):
+                self.knots.recalc_all(step)
+        profiler.mark("recalc")
+
+        self.display.clear((0, 0, 0))
+        self.hue = (self.hue + 1) % 360
+        self.color.hsla = (self.hue, 100, 50, 100)
+        self.knots.draw_all("line", 3, self.color, alpha=alpha)
+        self.display.compose()
+        if cursor is not None:
+            self.knots.highlight_anchor(cursor)
+        profiler.mark("draw")
+        if self.show_help:
+            self.help_overlay.draw(self.display, self.knot)
+        profiler.mark("help")
+        if profiler.show_hud:
+            profiler.draw_hud(self.display, self.help_overlay.courier)
+        profiler.mark("hud")
+
+        self.display.present()
+        profiler.mark("flip")
+        return True
+
+
+class HelpOverlay:
+    """
+    Экран справки программы
+
+    Фон, рамка и таблица клавиш рисуются один раз в кэшированный слой,
+    а число точек текущей кривой - в отдельный маленький слой, который 
+    перерисовывается только при смене значения
+
+    Шрифты берутся из FontCache при первом показе справки или HUD
+    """
+    ROWS = (
+        ("F1", "Show Help"),
+        ("R", "Restart"),
+        ("P", "Pause/Play"),
+        ("Num+", "More points"),
+        ("Num-", "Less points"),
+        ("→", "Next Knot"),
+        ("←", "Previous Knot"),
+        ("↑", "Increase speed"),
+        ("↓", "Decrease speed"),
+        ("F2", "Frame profiler HUD"),
+        ("S / L", "Save / Load scene"),
+        ("", ""),
+        )
+    TEXT_COLOR = (128, 128, 255)
+    fonts: FontCache
+
+    def __init__(self, fonts: FontCache) -> None:
+        self.fonts = fonts
+        self.__static = CachedLayer(self.__render_static)
+        self.__value = CachedLayer(self.__render_value)
+
+    @property
+    def courier(self) -> pygame.font.Font:
+        """моноширинный шрифт, загружается при первом обращении"""
+        return self.fonts.get("courier", 24)
+
+    @property
+    def serif(self) -> pygame.font.Font:
+        """шрифт с засечками, загружается при первом обращении"""
+        return self.fonts.get("serif", 24)
+
+    def __render_static(self, size: Tuple[int, int], courier: Any, 
+                        serif: Any, rows: tuple) -> pygame.Surface:
+        layer = pygame.Surface(size)
+        layer.fill((50, 50, 50))
+        width, height = size
+        pygame.draw.lines(layer, (255, 50, 50, 255), True, [
+            (0, 0), (width, 0), (width, height), (0, height)], 5)
+        rows = rows + (("", "Current points"),)
+        for i, text in enumerate(rows):
+            layer.blit(courier.render(text[0], True, self.TEXT_COLOR), 
+                       (100, 100 + 30 * i))
+            layer.blit(serif.render(text[1], True, self.TEXT_COLOR),
+                       (200, 100 + 30 * i))
+        return layer
+
+    @staticmethod
+    def __render_value(courier: Any, value: str) -> pygame.Surface:
+        return courier.render(value, True, HelpOverlay.TEXT_COLOR, 
+                              (50, 50, 50))
+
+    def draw(self, display: Display, knot: Knot) -> None:
+        """выводит справку поверх кадра"""
+        display.blit(self.__static.get(
+            display.get_size(), self.courier, self.serif, self.ROWS), (0, 0))
+        display.blit(self.__value.get(
+            self.courier, str(knot.knot_points_count)),
+            (100, 100 + 30 * len(self.ROWS)))
+        display.mark_dirty(display.get_rect())
 
 
 if __name__ == "__main__":
-    pygame.init()
-    COURIER = pygame.font.SysFont("courier", 24)
-    SERIF = pygame.font.SysFont("serif", 24)
-    gameDisplay = Display(SCREEN_DIM, caption="MyScreenSaver")
-
-    knots = KnotsManager(max=10, displ=gameDisplay)
-    knot = knots.get_next()
-    working = True
-    show_help = False
-    pause = True
-
-    hue = 0
-    color = pygame.Color(0)
-
-    while working:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                working = False
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE:
-                    working = False
-                if event.key == pygame.K_r:
-                    knot.points = []
-                    knot.speeds = []
-                if event.key == pygame.K_p:
-                    pause = not pause
-                if event.key == pygame.K_KP_PLUS:
-                    knot.knot_points_count += 1
-                if event.key == pygame.K_F1:
-                    show_help = not show_help
-                if event.key == pygame.K_KP_MINUS:
-                    knot.knot_points_count -= 1 if knot.knot_points_count > 1 else 0
-                if event.key == pygame.K_RIGHT:
-                    knot = knots.get_next()
-                if event.key == pygame.K_LEFT:
-                    knot = knots.get_prev()
-                if event.key == pygame.K_UP:
-                    knot.speeds = [ i*1.5 for i in knot.speeds]
-                if event.key == pygame.K_DOWN:
-                    knot.speeds = [ i*(1/1.5) for i in knot.speeds]
-                    
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                if event.button == 1:
-                    knot.add_base_point(
-                        Vec2d(*event.pos), 
-                        Vec2d(random.random() * 2, random.random() * 2))
-                if event.button == 3:
-                    knot.delete_base_point(Vec2d(*event.pos))
-
-        gameDisplay.fill((0, 0, 0))
-        hue = (hue + 1) % 360
-        color.hsla = (hue, 100, 50, 100)
-        knots.draw_all("line", 3, color)
-        if not pause:
-            knots.recalc_all()
-        if show_help:
-            draw_help()
-
-        pygame.display.flip()
+    parser = argparse.ArgumentParser(description="MyScreenSaver")
+    parser.add_argument(
+        "--dirty-rects", action="store_true",
+        help="redraw and update only the changed screen regions")
+    parser.add_argument(
+        "--profile-csv", metavar="PATH",
+        help="write per-frame phase timings to a CSV file")
+    parser.add_argument(
+        "--fps", type=FrameScheduler.fps, default=60,
+        help="frame rate cap, 0 for uncapped (default: %(default)s)")
+    parser.add_argument(
+        "--sim-rate", type=FrameScheduler.sim_rate, default=60,
+        help="simulation steps per second (default: %(default)s)")
+    parser.add_argument(
+        "--workers", type=int, default=0,
+        help="recalculate knots in N processes, 0 for serial")
+    parser.add_argument(
+        "--tolerance", type=Knot.pixel_tolerance, metavar="PX",
+        help="adaptive curve tessellation with the given pixel error")
+    parser.add_argument(
+        "--target-fps", type=float,
+        help="lower knot quality to hold this frame rate")
+    parser.add_argument(
+        "--scene", metavar="PATH", default="scene.knots",
+        help="scene file loaded at start if it exists, "
+             "S saves and L reloads it (default: %(default)s)")
+    parser.add_argument(
+        "--seed", type=int,
+        help="random seed, a fresh one by default")
+    parser.add_argument(
+        "--record", metavar="LOG",
+        help="record input events and the seed to a session log")
+    parser.add_argument(
+        "--replay", metavar="LOG",
+        help="replay a session log headless, without a window")
+    parser.add_argument(
+        "--frames-dir", metavar="DIR",
+        help="with --replay, write every frame as an image to DIR")
+    parser.add_argument(
+        "--frame-format", default="png", choices=("png", "bmp", "tga"),
+        help="image format for --frames-dir (default: %(default)s)")
+    parser.add_argument(
+        "--interaction", choices=AnchorInteraction.MODES,
+        help="anchors of all knots repel or bounce off each other")
+    parser.add_argument(
+        "--interaction-radius", type=float, default=24, metavar="PX",
+        help="distance at which anchors interact (default: %(default)s)")
+    parser.add_argument(
+        "--interaction-strength", type=float,
+        help="repulsion in px/s^2 (default: 600) or bounce "
+             "restitution (default: 1)")
+    parser.add_argument(
+        "--trail", type=Display.trail_decay, metavar="DECAY",
+        help="leave fading trails, keeping DECAY (0..1) of the "
+             "brightness per frame")
+    parser.add_argument(
+        "--control", metavar="SOCKET",
+        help="accept text commands on a Unix domain socket")
+    parser.add_argument(
+        "--font-cache", metavar="PATH", default=FontCache.default_path(),
+        help="file with cached font paths (default: %(default)s)")
+    parser.add_argument(
+        "--startup-time", action="store_true",
+        help="print the time from start to the first frame")
+    args = parser.parse_args()
+    startup = StartupTimer(STARTED) if args.startup_time else None
+    if startup is not None:
+        startup.mark("import")
+
+    if args.record and args.target_fps:
+        # качество кривых зависит от времени кадров, его не повторить
+        parser.error("--record cannot be combined with --target-fps")
+    if args.record and args.control:
+        # команды приходят в произвольные кадры и не попадают в журнал
+        parser.error("--record cannot be combined with --control")
+
+    replay = None
+    scenes = None
+    sim_rate = args.sim_rate
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    if args.replay:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        try:
+            (seed, sim_rate, screen_size, options), scenes, replay = \
+                SessionRecorder.read(args.replay)
+        except (OSError, ValueError) as error:
+            parser.error(f"--replay: {error}")
+        if screen_size != SCREEN_DIM:
+            parser.error(f"{args.replay} was recorded at {screen_size}")
+        vars(args).update(options)
+    random.seed(seed)
+
+    pygame.display.init()
+    gameDisplay = Display(SCREEN_DIM, caption="MyScreenSaver",
+                          dirty_rects=args.dirty_rects, trail=args.trail)
+
+    profiler = FrameProfiler(csv_path=args.profile_csv)
+    interaction = None
+    if args.interaction:
+        interaction = AnchorInteraction(args.interaction,
+                                        args.interaction_radius,
+                                        args.interaction_strength)
+    try:
+        knots = KnotsManager(max=10, displ=gameDisplay,
+                             workers=args.workers, interaction=interaction,
+                             tolerance=args.tolerance)
+    except (ImportError, ValueError) as error:
+        parser.error(f"--workers: {error}")
+    recorder = None
+    if args.record and replay is None:
+        recorder = SessionRecorder(
+            args.record, seed, sim_rate, SCREEN_DIM, args.tolerance,
+            args.interaction, args.interaction_radius,
+            args.interaction_strength, args.trail, args.dirty_rects)
+    saver = ScreenSaver(gameDisplay, knots, profiler, 
+                        HelpOverlay(FontCache(args.font_cache)), args.scene,
+                        save_scenes=replay is None, recorder=recorder,
+                        scenes=scenes)
+    if startup is not None:
+        startup.mark("init")
+
+    if replay is not None:
+        exporter = None
+        if args.frames_dir:
+            exporter = FrameExporter(args.frames_dir, args.frame_format)
+        for steps, alpha, cursor, events in replay:
+            profiler.start_frame()
+            handled = False
+            for event in events:
+                handled = saver.handle_event(event) or handled
+            profiler.mark("events")
+            saver.frame(steps, 1 / sim_rate, alpha, handled, cursor)
+            profiler.end_frame()
+            if startup is not None:
+                startup.mark("first frame")
+                sys.stderr.write(f"startup: {startup.report()}\n")
+                startup = None
+            if exporter is not None:
+                exporter.submit(gameDisplay.get_surface())
+            if not saver.working:
+                break
+        if exporter is not None:
+            exporter.close()
+
+    else:
+        scheduler = FrameScheduler(fps_cap=args.fps, sim_rate=sim_rate)
+        governor = None
+        if args.target_fps:
+            governor = QualityGovernor(args.target_fps)
+        server = None
+        if args.control:
+            try:
+                server = CommandServer(args.control)
+            except OSError as error:
+                parser.error(f"--control: {error}")
+
+        while saver.working:
+            profiler.start_frame()
+            steps, alpha = scheduler.tick()
+            profiler.mark("wait")
+            cursor = None
+            if pygame.mouse.get_focused():
+                cursor = pygame.mouse.get_pos()
+            if recorder is not None:
+                recorder.frame(steps, alpha, cursor)
+            handled = False
+            for event in pygame.event.get():
+                if saver.handle_event(event):
+                    handled = True
+                    if recorder is not None:
+                        recorder.event(event)
+            if server is not None:
+                for command in server.drain():
+                    saver.execute(command)
+                    handled = True
+            profiler.mark("events")
+
+            if not saver.frame(steps, scheduler.step, alpha, handled, cursor):
+                continue
+            profiler.end_frame()
+            if startup is not None:
+                startup.mark("first frame")
+                sys.stderr.write(f"startup: {startup.report()}\n")
+                startup = None
+            if governor is not None:
+                governor.update(profiler.work_time(), 
+                                knots.active, saver.knot)
+
+        if recorder is not None:
+            recorder.close()
+        if server is not None:
+            server.close()
 
+    profiler.close()
+    knots.close()
     pygame.display.quit()
     pygame.quit()
     exit(0)
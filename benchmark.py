@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк конвейера заставки без окна (SDL_VIDEODRIVER=dummy)
+
+Строит сцену заданного размера со случайными опорными точками
+(seed фиксирован) и замеряет этапы Knot.recalc_knot, Polyline.recalc_points,
+KnotsManager.recalc_all и KnotsManager.draw_all (с --interaction еще
+AnchorInteraction.apply): перцентили времени кадра,
+пропускную способность и пиковую память, а также время построения
+сцены через KnotsManager.add_knots. Результат пишется в JSON,
+чтобы сравнивать версии между собой.
+
+    SDL_VIDEODRIVER=dummy python benchmark.py --knots 10 --anchors 30 \\
+        --points 35 --frames 200 --output bench.json
+"""
+
+from __future__ import annotations
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+from Refactoring import (
+    SCREEN_DIM, AnchorInteraction, Display, KnotsManager, Polyline, np)
+
+
+def build_scene(display: Display, knots: int, anchors: int,
+                knot_points_count: int, seed: int,
+                use_numpy: bool, workers: int = 0) -> KnotsManager:
+    """строит сцену из knots кривых по anchors опорных точек"""
+    rng = random.Random(seed)
+    manager = KnotsManager(max=knots, displ=display, workers=workers,
+                           use_numpy=use_numpy)
+    points, speeds = [], []
+    for _ in range(knots):
+        anchors_xy, speeds_xy = [], []
+        for _ in range(anchors):
+            anchors_xy.append((rng.random() * display.width,
+                               rng.random() * display.height))
+            speeds_xy.append((rng.random() * 2, rng.random() * 2))
+        points.append(anchors_xy)
+        speeds.append(speeds_xy)
+    manager.add_knots(points, speeds, knot_points_count)
+    manager.curr_knot = knots - 1
+    return manager
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """возвращает перцентиль q (0..100) отсортированной выборки"""
+    index = min(len(samples) - 1, round(q / 100 * (len(samples) - 1)))
+    return samples[index]
+
+
+def measure(stage: Callable[[], int], frames: int,
+            memory_frames: int) -> Dict[str, float]:
+    """
+    замеряет этап: stage выполняет один кадр и возвращает
+    число обработанных точек кривых
+    """
+    times = []
+    processed = 0
+    for _ in range(frames):
+        start = time.perf_counter()
+        processed += stage()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    for _ in range(memory_frames):
+        stage()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = sum(times)
+    times.sort()
+    return {
+        "frames": frames,
+        "mean_ms": total / frames * 1000,
+        "p50_ms": percentile(times, 50) * 1000,
+        "p90_ms": percentile(times, 90) * 1000,
+        "p99_ms": percentile(times, 99) * 1000,
+        "max_ms": times[-1] * 1000,
+        "frames_per_s": frames / total if total else float("inf"),
+        "points_per_s": processed / total if total else float("inf"),
+        "peak_kib": peak / 1024,
+    }
+
+
+def allocations(frame: Callable[[], Any], frames: int,
+                warmup: int) -> Dict[str, float]:
+    """
+    замеряет память, которую выделяют кадры в установившемся режиме:
+    наибольший пик сверх памяти на начало кадра, прирост за все кадры
+    и число сборок мусора первого поколения
+
+    Кадры прогрева идут уже под tracemalloc: иначе освобождение
+    объектов, созданных до начала трассировки, не учитывается,
+    а их замены выглядят как прирост
+    """
+    tracemalloc.start()
+    for _ in range(warmup):
+        frame()
+    collections = gc.get_stats()[0]["collections"]
+    start, _ = tracemalloc.get_traced_memory()
+    worst = 0
+    for _ in range(frames):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        frame()
+        _, peak = tracemalloc.get_traced_memory()
+        worst = max(worst, peak - before)
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "frames": frames,
+        "frame_peak_bytes": worst,
+        "growth_bytes": end - start,
+        "gc_collections": gc.get_stats()[0]["collections"] - collections,
+    }
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """строит сцену и замеряет все этапы конвейера"""
+    pygame.display.init()
+    display = Display(args.screen, caption="benchmark", trail=args.trail)
+    use_numpy = np is not None and not args.no_numpy
+    start = time.perf_counter()
+    manager = build_scene(display, args.knots, args.anchors, args.points,
+                          args.seed, use_numpy, args.workers)
+    build_ms = (time.perf_counter() - start) * 1000
+    knots = manager.active
+    color = pygame.Color(255, 0, 0)
+
+    def curve_points() -> int:
+        return sum(len(knot.knot_points) for knot in knots)
+
+    def recalc_knot() -> int:
+        for knot in knots:
+            knot.invalidate()
+            knot.recalc_knot()
+        return curve_points()
+
+    def recalc_points() -> int:
+        for knot in knots:
+            Polyline.recalc_points(knot)
+        return sum(len(knot.points) for knot in knots)
+
+    def recalc_all() -> int:
+        manager.recalc_all()
+        return curve_points()
+
+    def draw_all() -> int:
+        display.clear((0, 0, 0))
+        manager.draw_all("line", 3, color)
+        display.compose()
+        return curve_points()
+
+    stages = {
+        "Knot.recalc_knot": recalc_knot,
+        "Polyline.recalc_points": recalc_points,
+        "KnotsManager.recalc_all": recalc_all,
+        "KnotsManager.draw_all": draw_all,
+    }
+    if args.interaction:
+        interaction = AnchorInteraction(args.interaction,
+                                        args.interaction_radius)
+
+        def interact() -> int:
+            interaction.apply(knots, 1 / 60)
+            return sum(len(knot.points) for knot in knots)
+
+        stages["AnchorInteraction.apply"] = interact
+    results = {}
+    for name, stage in stages.items():
+        for _ in range(args.warmup):
+            stage()
+        results[name] = measure(stage, args.frames, args.memory_frames)
+    allocs = None
+    if args.check_allocs is not None:
+        def frame() -> None:
+            manager.recalc_all(1 / 60)
+            display.clear((0, 0, 0))
+            manager.draw_all("line", 3, color, alpha=0.5)
+            display.compose()
+
+        allocs = allocations(frame, args.frames, max(args.warmup, 1))
+    manager.close()
+    pygame.display.quit()
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "numpy": np.__version__ if np is not None else None,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "scene": {
+            "knots": args.knots,
+            "anchors": args.anchors,
+            "knot_points_count": args.points,
+            "seed": args.seed,
+            "use_numpy": use_numpy,
+            "workers": args.workers,
+            "build_ms": build_ms,
+            "screen": list(args.screen),
+            "trail": args.trail,
+            "interaction": args.interaction,
+            "interaction_radius": args.interaction_radius,
+        },
+        "stages": results,
+        "allocations": allocs,
+    }
+
+
+def screen_size(value: str) -> Tuple[int, int]:
+    """разбирает размер экрана вида 800x600"""
+    width, _, height = value.lower().partition("x")
+    try:
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"bad screen size {value!r}")
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--knots", type=int, default=10,
+                        help="number of knots in the scene")
+    parser.add_argument("--anchors", type=int, default=30,
+                        help="anchor points per knot")
+    parser.add_argument("--points", type=int, default=35,
+                        help="knot_points_count of every knot")
+    parser.add_argument("--frames", type=int, default=200,
+                        help="timed frames per stage")
+    parser.add_argument("--warmup", type=int, default=10,
+                        help="untimed frames per stage")
+    parser.add_argument("--memory-frames", type=int, default=10,
+                        help="frames traced for peak memory")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="scene RNG seed")
+    parser.add_argument("--no-numpy", action="store_true",
+                        help="use the pure Vec2d engine")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="parallel recalc processes, 0 for serial")
+    parser.add_argument("--interaction", choices=AnchorInteraction.MODES,
+                        help="also time anchor interaction in this mode")
+    parser.add_argument("--interaction-radius", type=float, default=24,
+                        help="anchor interaction radius in pixels")
+    parser.add_argument("--screen", type=screen_size, default=SCREEN_DIM,
+                        metavar="WxH", help="screen size, e.g. 3840x2160")
+    parser.add_argument("--trail", type=Display.trail_decay,
+                        metavar="DECAY",
+                        help="draw in trail mode with this decay")
+    parser.add_argument("--check-allocs", type=int, metavar="BYTES",
+                        help="fail if a steady-state frame allocates "
+                             "more than BYTES")
+    parser.add_argument("--output", default="-",
+                        help="JSON output file, '-' for stdout")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    allocs = report["allocations"]
+    status = 0
+    if allocs is not None and allocs["frame_peak_bytes"] > args.check_allocs:
+        sys.stderr.write(
+            f"frame allocates {allocs['frame_peak_bytes']} bytes, "
+            f"limit {args.check_allocs}\n")
+        status = 1
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
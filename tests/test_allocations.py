@@ -0,0 +1,104 @@
+"""
+Регрессионный тест выделения памяти в установившемся режиме
+
+Гоняет полный кадр ScreenSaver.frame - шаг симуляции, кривые,
+подсветку опорной точки под курсором, справку и HUD - под tracemalloc
+и проверяет, что кадры не копят память, не запускают сборку мусора
+и выделяют на кадр лишь короткоживущие числа
+"""
+
+import gc
+import os
+import random
+import sys
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame
+import pytest
+
+from Refactoring import (Display, FontCache, FrameProfiler, HelpOverlay,
+                         KnotsManager, ScreenSaver, Vec2d, np)
+
+WARMUP = 300
+FRAMES = 600
+# пик одного кадра сверх памяти на его начало: буфер координат внутри
+# pygame.draw.lines, временные float и int и, с numpy, промежуточные
+# массивы; объекты на каждую точку кривых дали бы десятки килобайт
+FRAME_PEAK_LIMIT = {"vec2d": 8 * 1024, "numpy": 16 * 1024}
+GROWTH_LIMIT = 1024
+
+
+@pytest.fixture
+def saver(request, tmp_path):
+    pygame.display.init()
+    display = Display((800, 600), caption="test")
+    knots = KnotsManager(max=10, displ=display,
+                         use_numpy=request.param == "numpy")
+    profiler = FrameProfiler()
+    profiler.show_hud = True
+    saver = ScreenSaver(display, knots, profiler,
+                        HelpOverlay(FontCache(str(tmp_path / "fonts.json"))),
+                        str(tmp_path / "scene.knots"))
+    random.seed(1)
+    for i in range(12):
+        saver.handle_event(pygame.event.Event(
+            pygame.MOUSEBUTTONDOWN, button=1,
+            pos=(50 + 60 * i, 100 + i % 3 * 150)))
+    saver.pause = False
+    saver.show_help = True
+    yield saver
+    knots.close()
+    profiler.close()
+    pygame.display.quit()
+    pygame.quit()
+
+
+@pytest.mark.parametrize(
+    "saver",
+    ["vec2d", pytest.param("numpy", marks=pytest.mark.skipif(
+        np is None, reason="numpy is not installed"))],
+    indirect=True)
+def test_steady_state_frame_allocations(saver):
+    profiler = saver.profiler
+    knot = saver.knots.active[0]
+
+    def frame():
+        # курсор следует за первой опорной точкой, как мышь за ней:
+        # кадр ищет и обводит ее
+        anchor = knot.points[0]
+        if isinstance(anchor, Vec2d):
+            cursor = (round(anchor.x), round(anchor.y))
+        else:
+            cursor = (round(float(anchor[0])), round(float(anchor[1])))
+        profiler.start_frame()
+        profiler.mark("events")
+        assert saver.frame(1, 1 / 60, 0.5, False, cursor)
+        profiler.end_frame()
+
+    tracemalloc.start()
+    try:
+        for _ in range(WARMUP):
+            frame()
+        assert saver.hover is not None
+        collections = gc.get_stats()[0]["collections"]
+        start, _ = tracemalloc.get_traced_memory()
+        worst = 0
+        for _ in range(FRAMES):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            frame()
+            _, peak = tracemalloc.get_traced_memory()
+            worst = max(worst, peak - before)
+        end, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert saver.hover is not None
+    assert gc.get_stats()[0]["collections"] == collections
+    assert end - start < GROWTH_LIMIT
+    engine = "numpy" if saver.knots.knots[0].use_numpy else "vec2d"
+    assert worst < FRAME_PEAK_LIMIT[engine]